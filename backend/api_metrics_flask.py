@@ -1,32 +1,87 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from metrics_calculations import (
+    METRIC_SPECS,
+    build_iv_surface,
+    calculate_expiry_structure,
     classify_strikes,
-    calculate_totals,
     calculate_difference,
     calculate_difference_percent,
-    calculate_bid_ask_imbalance,
-    calculate_bid_ask_spread,
+    empty_metric_result,
+    evaluate_metric_specs,
 )
 from datetime import datetime, timezone
-from pymongo import DESCENDING
-from database import db, metrics_collection, option_chain_collection
+import threading
+import bson
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import get_database
+from singleflight import SingleFlight
+from encoding import encoded_response
+from profiling import annotate, is_profiling, profiled
 
 metrics_bp = Blueprint('metrics', __name__)
 
-def calculate_metrics_internal(instrument_key, expiry_date):
-    # Internal function to calculate metrics without HTTP context
-    # Returns metrics dict or raises Exception
-    # Fetch latest option chain data for given instrument and expiry from MongoDB
-    option_chain_data_doc = option_chain_collection.find_one(
+def init_metrics_state(app):
+    """Per-app state used by the metrics endpoints; called from create_app."""
+    # Concurrent metric requests for the same (instrument_key, expiry_date) share one computation
+    app.extensions['metrics_flight'] = SingleFlight()
+    # instrument_key -> (snapshot signature, term structure result)
+    app.extensions['term_structure_cache'] = {}
+    app.extensions['term_structure_cache_lock'] = threading.Lock()
+
+def get_metrics_flight():
+    return current_app.extensions['metrics_flight']
+
+def empty_metrics(current_price):
+    # Metrics reported when there is no option chain data to aggregate
+    metrics = {"current_price": current_price, "difference": {"call": {}, "put": {}}, "difference_percent": {"call": {}, "put": {}}}
+    for spec in METRIC_SPECS.values():
+        metrics[spec.name] = empty_metric_result(spec)
+    return metrics
+
+def latest_snapshot_id(instrument_key, expiry_date):
+    # _id of the latest option chain snapshot, read from the (instrument_key, expiry_date, fetched_at) index
+    snapshot = get_database().option_chain.find_one(
         {'instrument_key': instrument_key, 'expiry_date': expiry_date},
+        {'_id': 1},
         sort=[('fetched_at', DESCENDING)]
     )
+    return snapshot['_id'] if snapshot else None
+
+def calculate_snapshot_metrics(instrument_key, expiry_date, snapshot_id):
+    # Concurrent requests for the same snapshot share one computation. Keying on the
+    # snapshot means a run started after a new insert never joins one that read an older snapshot.
+    # Returns (metrics, shared); shared is True when this caller joined another request's run.
+    return get_metrics_flight().do_shared(
+        (instrument_key, expiry_date, snapshot_id), calculate_metrics_internal, instrument_key, expiry_date, snapshot_id
+    )
+
+def calculate_metrics_internal(instrument_key, expiry_date, snapshot_id=None):
+    # Internal function to calculate metrics without HTTP context
+    # Returns metrics dict or raises Exception
+    # snapshot_id pins the option chain snapshot; the latest one is used otherwise
+    database = get_database()
+    if snapshot_id is not None:
+        option_chain_data_doc = database.option_chain.find_one({'_id': snapshot_id})
+    else:
+        # Fetch latest option chain data for given instrument and expiry from MongoDB
+        option_chain_data_doc = database.option_chain.find_one(
+            {'instrument_key': instrument_key, 'expiry_date': expiry_date},
+            sort=[('fetched_at', DESCENDING)]
+        )
 
     if not option_chain_data_doc:
         raise Exception("Option chain data not found")
 
     data = option_chain_data_doc.get('data', [])
     current_price = option_chain_data_doc.get('underlying_spot_price')
+    if is_profiling():
+        annotate(
+            instrument_key=instrument_key,
+            expiry_date=expiry_date,
+            strike_count=len(data),
+            payload_bytes=len(bson.encode(option_chain_data_doc))
+        )
 
     if current_price is None:
         # If no underlying spot price, but data exists, set current_price to nearest ATM strike or 0
@@ -35,81 +90,69 @@ def calculate_metrics_internal(instrument_key, expiry_date):
             current_price = min(strikes, key=lambda x: abs(x - 0))  # fallback to 0
         else:
             # Return empty metrics
-            return {
-                "current_price": 0,
-                "totals": {"call": {}, "put": {}},
-                "difference": {"call": {}, "put": {}},
-                "difference_percent": {"call": {}, "put": {}},
-                "bid_ask_imbalance": {"call": 0.0, "put": 0.0},
-                "bid_ask_spread": {"call": {"bid_avg": 0.0, "ask_avg": 0.0}, "put": {"bid_avg": 0.0, "ask_avg": 0.0}}
-            }
+            return empty_metrics(0)
     if not data:
         # Return empty metrics if data is empty
-        return {
-            "current_price": current_price,
-            "totals": {"call": {}, "put": {}},
-            "difference": {"call": {}, "put": {}},
-            "difference_percent": {"call": {}, "put": {}},
-            "bid_ask_imbalance": {"call": 0.0, "put": 0.0},
-            "bid_ask_spread": {"call": {"bid_avg": 0.0, "ask_avg": 0.0}, "put": {"bid_avg": 0.0, "ask_avg": 0.0}}
-        }
+        return empty_metrics(current_price)
 
     strikes = [item['strike_price'] for item in data]
     strikes_classification = classify_strikes(current_price, strikes)
 
-    columns = ['oi', 'volume', 'iv', 'bid_qty', 'ask_qty']
+    columns = list(METRIC_SPECS['totals'].columns)
 
-    totals = calculate_totals(data, strikes_classification, columns)
+    # All registered metric specs are evaluated in one pass over the chain
+    results = evaluate_metric_specs(data, strikes_classification)
+    totals = results['totals']
 
-    # Fetch baseline metrics from MongoDB or create if not exists
-    baseline_metrics_doc = metrics_collection.find_one({
+    # Fetch baseline metrics from MongoDB or atomically store current totals as baseline
+    baseline_filter = {
         'instrument_key': instrument_key,
         'expiry_date': expiry_date,
         'is_baseline': True
-    })
-
-    if not baseline_metrics_doc:
-        # Store current totals as baseline
-        baseline_metrics_doc = {
-            'instrument_key': instrument_key,
-            'expiry_date': expiry_date,
-            'is_baseline': True,
-            'totals': totals,
-            'created_at': datetime.now(timezone.utc),
-            'updated_at': datetime.now(timezone.utc)
-        }
-        metrics_collection.insert_one(baseline_metrics_doc)
+    }
+    try:
+        baseline_metrics_doc = database.metrics.find_one_and_update(
+            baseline_filter,
+            {
+                '$setOnInsert': {
+                    'totals': totals,
+                    'created_at': datetime.now(timezone.utc),
+                    'updated_at': datetime.now(timezone.utc)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A concurrent upsert inserted the baseline first
+        baseline_metrics_doc = database.metrics.find_one(baseline_filter)
 
     difference = calculate_difference(totals, baseline_metrics_doc['totals'], columns)
     difference_percent = calculate_difference_percent(difference, totals, columns)
-    bid_ask_imbalance = calculate_bid_ask_imbalance(data, strikes_classification)
-    bid_ask_spread = calculate_bid_ask_spread(data, strikes_classification)
 
     # Store calculated metrics in MongoDB
     metrics_doc = {
         'instrument_key': instrument_key,
         'expiry_date': expiry_date,
         'is_baseline': False,
-        'totals': totals,
+        'snapshot_id': option_chain_data_doc['_id'],
+        **results,
         'difference': difference,
         'difference_percent': difference_percent,
-        'bid_ask_imbalance': bid_ask_imbalance,
-        'bid_ask_spread': bid_ask_spread,
         'created_at': datetime.now(timezone.utc),
         'updated_at': datetime.now(timezone.utc)
     }
-    metrics_collection.insert_one(metrics_doc)
+    database.metrics.insert_one(metrics_doc)
 
     return {
         "current_price": current_price,
-        "totals": totals,
+        **results,
         "difference": difference,
         "difference_percent": difference_percent,
-        "bid_ask_imbalance": bid_ask_imbalance,
-        "bid_ask_spread": bid_ask_spread
     }
 
 @metrics_bp.route("/calculate_metrics", methods=['POST'])
+@profiled('calculate_metrics')
 def calculate_metrics():
     try:
         request_data = request.get_json()
@@ -123,7 +166,95 @@ def calculate_metrics():
             if not instrument_key or not expiry_date:
                 return jsonify({"detail": "Missing instrument_key or expiry_date"}), 400
 
-        metrics_result = calculate_metrics_internal(instrument_key, expiry_date)
-        return jsonify(metrics_result)
+        snapshot_id = latest_snapshot_id(instrument_key, expiry_date)
+        if snapshot_id is None:
+            raise Exception("Option chain data not found")
+        metrics_result, shared = calculate_snapshot_metrics(instrument_key, expiry_date, snapshot_id)
+        annotate(instrument_key=instrument_key, expiry_date=expiry_date, coalesced=shared)
+        return encoded_response(metrics_result)
+    except Exception as e:
+        return jsonify({"detail": str(e)}), 500
+
+def active_expiries_pipeline(instrument_key):
+    # Aggregation returning the latest snapshot id of every expiry that has not passed yet.
+    # The sort matches the (instrument_key, expiry_date, fetched_at) index so $group/$first
+    # is served from the index instead of sorting every stored snapshot.
+    today = datetime.now(timezone.utc).date().isoformat()
+    return [
+        {'$match': {'instrument_key': instrument_key, 'expiry_date': {'$gte': today}}},
+        {'$sort': {'instrument_key': 1, 'expiry_date': 1, 'fetched_at': DESCENDING}},
+        {'$group': {'_id': '$expiry_date', 'snapshot_id': {'$first': '$_id'}}},
+    ]
+
+def compute_expiry_structure(snapshot):
+    data = snapshot.get('data') or []
+    if not data:
+        return None
+    current_price = snapshot.get('underlying_spot_price')
+    if current_price is None:
+        current_price = 0  # same fallback as calculate_metrics_internal
+    return {'current_price': current_price, **calculate_expiry_structure(data, current_price)}
+
+def calculate_term_structure_internal(instrument_key):
+    # Internal function to calculate the cross-expiry term structure without HTTP context.
+    # The result is cached per instrument until the latest snapshot of any active expiry changes.
+    option_chain_collection = get_database().option_chain
+    latest_snapshot_ids = {
+        doc['_id']: doc['snapshot_id']
+        for doc in option_chain_collection.aggregate(active_expiries_pipeline(instrument_key))
+    }
+    if not latest_snapshot_ids:
+        raise Exception("Option chain data not found")
+    signature = tuple(sorted((expiry, str(snapshot_id)) for expiry, snapshot_id in latest_snapshot_ids.items()))
+
+    term_structure_cache = current_app.extensions['term_structure_cache']
+    term_structure_cache_lock = current_app.extensions['term_structure_cache_lock']
+    with term_structure_cache_lock:
+        cached = term_structure_cache.get(instrument_key)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    # Load only the latest snapshot of every active expiry
+    snapshots = {
+        doc['expiry_date']: doc
+        for doc in option_chain_collection.find({'_id': {'$in': list(latest_snapshot_ids.values())}})
+    }
+    expiries = sorted(snapshots)
+    # Pure-Python and CPU bound, so expiries are computed in turn rather than on a thread pool
+    structures = {}
+    for expiry in expiries:
+        structure = compute_expiry_structure(snapshots[expiry])
+        if structure:
+            structures[expiry] = structure
+
+    result = {
+        "instrument_key": instrument_key,
+        "term_structure": [
+            {
+                "expiry_date": expiry,
+                "current_price": structure['current_price'],
+                "atm_strike": structure['atm_strike'],
+                "atm_iv": structure['atm_iv'],
+                "call_iv": structure['call_iv'],
+                "put_iv": structure['put_iv'],
+            }
+            for expiry, structure in structures.items()
+        ],
+        "pcr": {expiry: structure['pcr'] for expiry, structure in structures.items()},
+        "iv_surface": build_iv_surface({expiry: structure['smile'] for expiry, structure in structures.items()}),
+    }
+
+    with term_structure_cache_lock:
+        term_structure_cache[instrument_key] = (signature, result)
+    return result
+
+@metrics_bp.route("/term_structure", methods=['GET'])
+def term_structure():
+    try:
+        instrument_key = request.args.get('instrument_key')
+        if not instrument_key:
+            return jsonify({"detail": "Missing instrument_key"}), 400
+
+        return encoded_response(calculate_term_structure_internal(instrument_key))
     except Exception as e:
         return jsonify({"detail": str(e)}), 500
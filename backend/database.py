@@ -1,19 +1,101 @@
 import os
+import threading
+from flask import current_app, has_app_context
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
-    raise RuntimeError("Missing MONGO_URI environment variable")
+DEFAULT_DB_NAME = 'jabba_trader'
 
-# MongoDB setup
-client = MongoClient(MONGO_URI)
-db = client.jabba_trader
 
-# Collections
-users_collection = db.users
-option_chain_collection = db.option_chain
-metrics_collection = db.metrics
+class Database:
+    """
+    Lazily connected MongoDB handle.
+    Nothing touches the network until a collection is first used; indexes are
+    ensured at that point. Pass `client` to inject any pymongo-compatible
+    client (e.g. mongomock.MongoClient() for tests).
+    """
+
+    def __init__(self, uri=None, client=None, name=DEFAULT_DB_NAME):
+        self._uri = uri
+        self._client = client
+        self._name = name
+        self._db = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            if not self._uri:
+                raise RuntimeError("Missing MONGO_URI environment variable")
+            self._client = MongoClient(self._uri)
+        return self._client
+
+    @property
+    def db(self):
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    db = self.client[self._name]
+                    ensure_indexes(db)
+                    self._db = db
+        return self._db
+
+    @property
+    def users(self):
+        return self.db.users
+
+    @property
+    def option_chain(self):
+        return self.db.option_chain
+
+    @property
+    def metrics(self):
+        return self.db.metrics
+
+
+def ensure_indexes(db):
+    # Latest-snapshot lookups sort by fetched_at within an instrument/expiry
+    db.option_chain.create_index([('instrument_key', 1), ('expiry_date', 1), ('fetched_at', -1)])
+
+    # At most one baseline metrics document per instrument/expiry
+    try:
+        db.metrics.create_index(
+            [('instrument_key', 1), ('expiry_date', 1)],
+            unique=True,
+            partialFilterExpression={'is_baseline': True},
+            name='unique_baseline'
+        )
+    except OperationFailure as e:
+        # Existing duplicate baselines must be cleaned up before the index can be built
+        print(f"Could not create unique baseline index: {e}")
+
+
+# Used outside an application context (scripts, legacy imports)
+default_database = Database(uri=os.getenv("MONGO_URI"))
+
+
+def get_database():
+    """The current app's database, or the environment-configured default outside an app."""
+    if has_app_context():
+        return current_app.extensions['database']
+    return default_database
+
+
+# Collection attributes kept for existing `from database import ...` users; resolved on access
+_LEGACY_ATTRIBUTES = {
+    'client': 'client',
+    'db': 'db',
+    'users_collection': 'users',
+    'option_chain_collection': 'option_chain',
+    'metrics_collection': 'metrics',
+}
+
+
+def __getattr__(name):
+    if name in _LEGACY_ATTRIBUTES:
+        return getattr(get_database(), _LEGACY_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
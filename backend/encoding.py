@@ -0,0 +1,210 @@
+import gzip
+import json
+from datetime import datetime
+from flask import Response, current_app, request
+from metrics_calculations import classify_strikes, select_window
+
+# Both are listed in requirements.txt; without them br is not offered and msgpack requests get a 406
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMATS = ('json', 'msgpack')
+LAYOUTS = ('rows', 'columnar')
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+# Top-level option chain document fields kept when a field projection is requested
+SNAPSHOT_FIELDS = ('instrument_key', 'expiry_date', 'underlying_spot_price', 'fetched_at')
+
+
+class EncodingError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_fields(fields_arg):
+    """
+    Parses a comma separated list of per-strike field paths, e.g.
+    "call_options.market_data.oi,put_options.market_data.oi".
+    strike_price is always included. Returns None when no projection is requested.
+    Overlapping paths (e.g. "call_options,call_options.market_data.oi") are rejected,
+    as MongoDB refuses them in a projection.
+    """
+    if not fields_arg:
+        return None
+    fields = []
+    for field in (field.strip() for field in fields_arg.split(',')):
+        if field and field not in fields:
+            fields.append(field)
+    for field in fields:
+        if field.startswith('$') or '..' in field or field.startswith('.') or field.endswith('.'):
+            raise EncodingError(f"Invalid field '{field}'")
+    if 'strike_price' not in fields:
+        fields.insert(0, 'strike_price')
+    for field in fields:
+        for other in fields:
+            if other.startswith(f'{field}.'):
+                raise EncodingError(f"Field '{other}' overlaps with '{field}'")
+    return fields
+
+
+def parse_strike_window(strikes_arg):
+    """Parses the number of strikes to keep on each side of ATM (None for all)."""
+    if strikes_arg is None or strikes_arg == '':
+        return None
+    try:
+        strike_window = int(strikes_arg)
+    except ValueError:
+        raise EncodingError("strikes must be a non-negative integer")
+    if strike_window < 0:
+        raise EncodingError("strikes must be a non-negative integer")
+    return strike_window
+
+
+def window_strikes(strikes, current_price, strike_window):
+    """
+    Strikes within `strike_window` strikes of ATM, using the same ATM rule as the metrics.
+    """
+    if not strikes:
+        return []
+    classification = classify_strikes(current_price if current_price is not None else 0, strikes)
+    return sorted(select_window(classification, 'call', strike_window, strike_window))
+
+
+def option_chain_pipeline(snapshot_filter, fields=None, strikes=None):
+    """
+    Aggregation returning one option chain snapshot with the strike filter and
+    field projection applied inside MongoDB.
+    snapshot_filter selects the snapshot, e.g. {'_id': ...}; the latest match is returned.
+    """
+    pipeline = [
+        {'$match': snapshot_filter},
+        {'$sort': {'fetched_at': -1}},
+        {'$limit': 1},
+    ]
+    if strikes is not None:
+        pipeline.append({'$addFields': {
+            'data': {'$filter': {'input': '$data', 'as': 'item', 'cond': {'$in': ['$$item.strike_price', strikes]}}}
+        }})
+    if fields is not None:
+        projection = {field: 1 for field in SNAPSHOT_FIELDS}
+        projection.update({f'data.{field}': 1 for field in fields})
+        pipeline.append({'$project': projection})
+    return pipeline
+
+
+def get_path(item, path):
+    for key in path.split('.'):
+        if not isinstance(item, dict):
+            return None
+        item = item.get(key)
+    return item
+
+
+def leaf_paths(item, prefix=''):
+    """Dotted paths of every non-dict value in a nested dict."""
+    paths = []
+    for key, value in item.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict) and value:
+            paths.extend(leaf_paths(value, f'{path}.'))
+        else:
+            paths.append(path)
+    return paths
+
+
+def to_columnar(rows, fields=None):
+    """
+    Converts a list of nested per-strike dicts into {field path: [values]}.
+    Without explicit fields every leaf path seen in the rows becomes a column.
+    """
+    if fields is None:
+        fields = []
+        seen = set()
+        for row in rows:
+            for path in leaf_paths(row):
+                if path not in seen:
+                    seen.add(path)
+                    fields.append(path)
+    return {field: [get_path(row, field) for row in rows] for field in fields}
+
+
+def serialize_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def negotiate_content_encoding(accept_encoding):
+    """Picks br (when brotli is installed) or gzip from an Accept-Encoding header."""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0'):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, content_encoding):
+    if content_encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if content_encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def encode_body(payload, fmt='json', accept_encoding=None, json_dumps=None):
+    """
+    Serializes and optionally compresses a response payload.
+    Returns (body bytes, headers dict).
+    """
+    if fmt not in FORMATS:
+        raise EncodingError(f"Unsupported format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+    if fmt == 'msgpack':
+        if msgpack is None:
+            raise EncodingError("MessagePack output requires the msgpack package", 406)
+        body = msgpack.packb(payload, default=serialize_default, use_bin_type=True)
+        headers = {'Content-Type': 'application/msgpack'}
+    else:
+        dumps = json_dumps or (lambda obj: json.dumps(obj, default=serialize_default, separators=(',', ':')))
+        body = dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+
+    headers['Vary'] = 'Accept-Encoding'
+    content_encoding = negotiate_content_encoding(accept_encoding)
+    if content_encoding and len(body) >= MIN_COMPRESS_BYTES:
+        body = compress(body, content_encoding)
+        headers['Content-Encoding'] = content_encoding
+    return body, headers
+
+
+def encoded_response(payload, status_code=200):
+    """
+    Builds a Flask response honouring the request's `format` query parameter
+    (json or msgpack) and Accept-Encoding header.
+    """
+    fmt = request.args.get('format', 'json')
+    try:
+        body, headers = encode_body(
+            payload, fmt, request.headers.get('Accept-Encoding'),
+            lambda obj: current_app.json.dumps(obj, separators=(',', ':'))
+        )
+    except EncodingError as e:
+        return Response(json.dumps({"detail": str(e)}), status=e.status_code, mimetype='application/json')
+    return Response(body, status=status_code, headers=headers)
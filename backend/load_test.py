@@ -0,0 +1,152 @@
+"""
+Open-loop load generator for the option chain and metrics endpoints.
+
+Requests are issued on a fixed schedule at the target rate regardless of how
+long earlier requests take, so queueing shows up in the latency figures.
+
+Concurrent fetches of the same instrument/expiry are coalesced by the backend,
+so pass several instruments and expiries to measure polling capacity rather
+than the coalesced path; requests round-robin over every combination.
+
+    # terminal 1: python upstox_stub.py --port 9000 --latency-ms 80 --rate-limit-per-token 500
+    # terminal 2: UPSTOX_BASE_URL=http://localhost:9000 python main.py
+    python load_test.py --rps 20 --duration 30 --login-role loadtest \\
+        --instrument-keys "NSE_INDEX|Nifty 50,NSE_INDEX|Nifty Bank" --expiry-dates 2099-09-16,2099-09-23
+"""
+import argparse
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+ENDPOINTS = ('fetch', 'metrics', 'term_structure')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def build_request(endpoint, target, instrument_key, expiry_date, role):
+    """Returns (method, url, kwargs) for one request against `endpoint`."""
+    if endpoint == 'fetch':
+        payload = {'instrument_key': instrument_key, 'expiry_date': expiry_date}
+        if role:
+            payload['role'] = role
+        return 'POST', f"{target}/api/option_chain/fetch2", {'json': payload}
+    if endpoint == 'metrics':
+        payload = {'instrument_key': instrument_key, 'expiry_date': expiry_date}
+        return 'POST', f"{target}/api/metrics/calculate_metrics", {'json': payload}
+    if endpoint == 'term_structure':
+        return 'GET', f"{target}/api/metrics/term_structure", {'params': {'instrument_key': instrument_key}}
+    raise ValueError(f"Unknown endpoint '{endpoint}'")
+
+
+def parse_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def validate_endpoints(endpoints):
+    unknown = [endpoint for endpoint in endpoints if endpoint not in ENDPOINTS]
+    if unknown or not endpoints:
+        raise ValueError(f"Endpoints must be a subset of {', '.join(ENDPOINTS)}, got {endpoints}")
+
+
+def run_load(target, endpoints, rps, duration, instrument_keys, expiry_dates, role=None, concurrency=64,
+             timeout=30):
+    """
+    Issues requests at `rps` for `duration` seconds, round-robin over `endpoints`
+    and, within each endpoint, over every (instrument_key, expiry_date) combination.
+    Latency is measured from each request's scheduled send time, so time spent
+    waiting for a free worker counts towards it.
+    Returns endpoint -> {'latencies': [...seconds], 'errors': int, 'statuses': {code: count}}
+    plus the wall-clock duration.
+    """
+    validate_endpoints(endpoints)
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    results = {endpoint: {'latencies': [], 'errors': 0, 'statuses': {}} for endpoint in endpoints}
+    lock = threading.Lock()
+    chains = list(itertools.product(instrument_keys, expiry_dates))
+
+    def send(endpoint, instrument_key, expiry_date, scheduled):
+        method, url, kwargs = build_request(endpoint, target, instrument_key, expiry_date, role)
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+            status = response.status_code
+        except requests.exceptions.RequestException:
+            status = 'connection_error'
+        elapsed = time.perf_counter() - scheduled
+        with lock:
+            result = results[endpoint]
+            result['latencies'].append(elapsed)
+            result['statuses'][status] = result['statuses'].get(status, 0) + 1
+            if status == 'connection_error' or status >= 400:
+                result['errors'] += 1
+
+    total = int(rps * duration)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i in range(total):
+            scheduled = started + i / rps
+            pause = scheduled - time.perf_counter()
+            if pause > 0:
+                time.sleep(pause)
+            instrument_key, expiry_date = chains[(i // len(endpoints)) % len(chains)]
+            executor.submit(send, endpoints[i % len(endpoints)], instrument_key, expiry_date, scheduled)
+    return results, time.perf_counter() - started
+
+
+def format_report(results, elapsed):
+    lines = [f"{'endpoint':<16}{'requests':>10}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for endpoint, result in results.items():
+        latencies = result['latencies']
+        lines.append(
+            f"{endpoint:<16}{len(latencies):>10}{result['errors']:>8}{len(latencies) / elapsed:>9.1f}"
+            f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 90) * 1000:>10.1f}"
+            f"{percentile(latencies, 99) * 1000:>10.1f}{max(latencies, default=0) * 1000:>10.1f}"
+        )
+        lines.append(f"{'':<16}statuses: {result['statuses']}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the option chain and metrics endpoints")
+    parser.add_argument('--target', default='http://localhost:8000')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help=f"comma separated subset of {', '.join(ENDPOINTS)}")
+    parser.add_argument('--rps', type=float, default=10)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--instrument-keys', '--instrument-key', default='NSE_INDEX|Nifty 50',
+                        help="comma separated instrument keys")
+    parser.add_argument('--expiry-dates', '--expiry-date', required=True, help="comma separated expiry dates")
+    parser.add_argument('--role', help="role used for fetches (default: token pool picks)")
+    parser.add_argument('--login-role',
+                        help="store a stub token for this role via /api/auth/token before the run "
+                             "(backend must point at upstox_stub.py)")
+    args = parser.parse_args()
+    endpoints = parse_list(args.endpoints)
+    try:
+        validate_endpoints(endpoints)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.login_role:
+        response = requests.post(f"{args.target}/api/auth/token", json={'code': 'loadtest', 'role': args.login_role})
+        response.raise_for_status()
+
+    results, elapsed = run_load(args.target, endpoints, args.rps, args.duration, parse_list(args.instrument_keys),
+                                parse_list(args.expiry_dates), role=args.role, concurrency=args.concurrency)
+    print(f"Target {args.rps} rps for {args.duration}s, took {elapsed:.1f}s")
+    print(format_report(results, elapsed))
@@ -1,51 +1,161 @@
 import os
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, current_app, jsonify, request
 import requests
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from cryptography.fernet import Fernet
+from pymongo.errors import OperationFailure
 from datetime import datetime, timezone
 from flask_cors import CORS
+from database import DEFAULT_DB_NAME, Database, get_database
+from singleflight import SingleFlight
+from token_pool import NoTokenAvailable, TokenPool
+from upstox_client import DEFAULT_BASE_URL, UpstoxClient
+from encoding import (
+    LAYOUTS,
+    EncodingError,
+    encoded_response,
+    option_chain_pipeline,
+    parse_fields,
+    parse_strike_window,
+    to_columnar,
+    window_strikes,
+)
+from api_metrics_flask import calculate_snapshot_metrics, init_metrics_state, metrics_bp
+from profiling import (
+    DEFAULT_INTERVAL_MS,
+    DEFAULT_MAX_PROFILES,
+    DEFAULT_OUTPUT_DIR,
+    DEFAULT_THRESHOLD_MS,
+    Profiler,
+    annotate,
+    is_profiling,
+    profiled,
+    profiling_bp,
+)
 
 # --- Load Environment Variables ---
 load_dotenv()
 
-# --- Flask App Initialization ---
-app = Flask(__name__)
-CORS(app)
+api_bp = Blueprint('api', __name__)
+
+# HTTP status returned when the token pool cannot serve a request
+TOKEN_POOL_ERROR_STATUS = {'not_found': 404, 'invalid': 401, 'expired': 401, 'rate_limited': 429}
+
+
+def config_from_env():
+    """Default app configuration, read from the environment."""
+    return {
+        'UPSTOX_CLIENT_ID': os.getenv("UPSTOX_CLIENT_ID"),
+        'UPSTOX_CLIENT_SECRET': os.getenv("UPSTOX_CLIENT_SECRET"),
+        'UPSTOX_REDIRECT_URI': os.getenv("UPSTOX_REDIRECT_URI"),
+        # Point at a local upstox_stub.py server for offline load testing
+        'UPSTOX_BASE_URL': os.getenv("UPSTOX_BASE_URL", DEFAULT_BASE_URL),
+        'MONGO_URI': os.getenv("MONGO_URI"),
+        'MONGO_DB_NAME': os.getenv("MONGO_DB_NAME", DEFAULT_DB_NAME),
+        'ENCRYPTION_KEY': os.getenv("ENCRYPTION_KEY"),
+        # Opt-in sampling of slow fetch_option_chain / calculate_metrics requests
+        'PROFILING_ENABLED': os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes"),
+        'PROFILING_THRESHOLD_MS': float(os.getenv("PROFILING_THRESHOLD_MS", DEFAULT_THRESHOLD_MS)),
+        'PROFILING_INTERVAL_MS': float(os.getenv("PROFILING_INTERVAL_MS", DEFAULT_INTERVAL_MS)),
+        'PROFILING_DIR': os.getenv("PROFILING_DIR", DEFAULT_OUTPUT_DIR),
+        'PROFILING_MAX_FILES': int(os.getenv("PROFILING_MAX_FILES", DEFAULT_MAX_PROFILES)),
+        # POST /api/profiling is unauthenticated, so runtime changes are off unless explicitly allowed
+        'PROFILING_ALLOW_TOGGLE': os.getenv("PROFILING_ALLOW_TOGGLE", "").lower() in ("1", "true", "yes"),
+        # Injectable clients: any pymongo-compatible client and an UpstoxClient-like object
+        'MONGO_CLIENT': None,
+        'UPSTOX_CLIENT': None,
+    }
+
+
+def create_app(config=None):
+    """Creates the Flask app.
+    `config` overrides the environment defaults. MongoDB is connected and the
+    Fernet key is built lazily on first use, so creating an app does no I/O."""
+    app = Flask(__name__)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+    CORS(app)
+
+    app.extensions['database'] = Database(
+        uri=app.config['MONGO_URI'],
+        client=app.config['MONGO_CLIENT'],
+        name=app.config['MONGO_DB_NAME']
+    )
+    app.extensions['upstox'] = app.config['UPSTOX_CLIENT'] or UpstoxClient(
+        client_id=app.config['UPSTOX_CLIENT_ID'],
+        client_secret=app.config['UPSTOX_CLIENT_SECRET'],
+        redirect_uri=app.config['UPSTOX_REDIRECT_URI'],
+        base_url=app.config['UPSTOX_BASE_URL']
+    )
+    app.extensions['token_pool'] = TokenPool(lambda: load_pool_tokens(app))
+    # Per-app so apps with different stores never share in-flight fetches
+    app.extensions['option_chain_flight'] = SingleFlight()
+    init_metrics_state(app)
+    app.extensions['profiler'] = Profiler(
+        enabled=app.config['PROFILING_ENABLED'],
+        threshold_ms=app.config['PROFILING_THRESHOLD_MS'],
+        interval_ms=app.config['PROFILING_INTERVAL_MS'],
+        output_dir=app.config['PROFILING_DIR'],
+        max_profiles=app.config['PROFILING_MAX_FILES'],
+        allow_toggle=app.config['PROFILING_ALLOW_TOGGLE']
+    )
+
+    app.register_blueprint(api_bp)
+    app.register_blueprint(metrics_bp, url_prefix='/api/metrics')
+    app.register_blueprint(profiling_bp, url_prefix='/api/profiling')
+    return app
+
+
+def get_fernet(app=None):
+    """The app's Fernet instance, built from ENCRYPTION_KEY on first use."""
+    app = app or current_app
+    fernet = app.extensions.get('fernet')
+    if fernet is None:
+        encryption_key = app.config.get('ENCRYPTION_KEY')
+        if not encryption_key:
+            raise RuntimeError("Missing critical environment variable: ENCRYPTION_KEY")
+        fernet = app.extensions['fernet'] = Fernet(encryption_key.encode())
+    return fernet
+
 
-# --- Environment Variables ---
-UPSTOX_CLIENT_ID = os.getenv("UPSTOX_CLIENT_ID")
-UPSTOX_CLIENT_SECRET = os.getenv("UPSTOX_CLIENT_SECRET")
-UPSTOX_REDIRECT_URI = os.getenv("UPSTOX_REDIRECT_URI")
-MONGO_URI = os.getenv("MONGO_URI")
-ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
+def get_upstox():
+    return current_app.extensions['upstox']
 
-# --- Error Handling for Missing Config ---
-if not all([MONGO_URI, ENCRYPTION_KEY]):
-    raise RuntimeError("Missing critical environment variables: MONGO_URI or ENCRYPTION_KEY")
 
-# --- Cryptography & Database Setup ---
-fernet = Fernet(ENCRYPTION_KEY.encode())
-from database import db, users_collection, option_chain_collection
+def get_token_pool():
+    return current_app.extensions['token_pool']
 
 
-@app.route("/api/auth/login_url", methods=['GET'])
+def get_option_chain_flight():
+    return current_app.extensions['option_chain_flight']
+
+
+def load_pool_tokens(app):
+    """Loads and decrypts every stored role's access token for the token pool."""
+    fernet = get_fernet(app)
+    users_collection = app.extensions['database'].users
+    tokens = []
+    for user in users_collection.find({}, {'role': 1, 'encrypted_access_token': 1, 'updated_at': 1}):
+        try:
+            access_token = fernet.decrypt(user['encrypted_access_token']).decode('utf-8')
+        except Exception as e:
+            print(f"Skipping token for role {user.get('role')}: failed to decrypt access token: {e}")
+            continue
+        tokens.append((user['role'], access_token, user.get('updated_at')))
+    return tokens
+
+
+@api_bp.route("/api/auth/login_url", methods=['GET'])
 def get_login_url():
     """Generates the Upstox login URL."""
-    if not all([UPSTOX_CLIENT_ID, UPSTOX_REDIRECT_URI]):
+    upstox = get_upstox()
+    if not upstox.can_login:
         return jsonify({"detail": "Server is not configured for Upstox authentication."}), 500
 
-    auth_url = (
-        f"https://api.upstox.com/v2/login/authorization/dialog?"
-        f"client_id={UPSTOX_CLIENT_ID}&"
-        f"redirect_uri={UPSTOX_REDIRECT_URI}&"
-        f"response_type=code"
-    )
-    return jsonify({"auth_url": auth_url})
+    return jsonify({"auth_url": upstox.login_url()})
 
 
-@app.route("/api/auth/token", methods=['POST'])
+@api_bp.route("/api/auth/token", methods=['POST'])
 def get_token():
     """Exchanges the authorization code for an access token and stores it."""
     request_data = request.get_json()
@@ -55,29 +165,20 @@ def get_token():
     if not code or not role:
         return jsonify({"detail": "Missing code or role."}), 400
 
-    if not all([UPSTOX_CLIENT_ID, UPSTOX_CLIENT_SECRET, UPSTOX_REDIRECT_URI]):
+    upstox = get_upstox()
+    if not upstox.can_exchange_code:
         return jsonify({"detail": "Server is not configured for Upstox authentication."}), 500
 
-    url = "https://api.upstox.com/v2/login/authorization/token"
-    headers = {"accept": "application/json", "Content-Type": "application/x-www-form-urlencoded"}
-    data = {
-        "client_id": UPSTOX_CLIENT_ID,
-        "client_secret": UPSTOX_CLIENT_SECRET,
-        "redirect_uri": UPSTOX_REDIRECT_URI,
-        "grant_type": "authorization_code",
-        "code": code,
-    }
-
     try:
-        response = requests.post(url, headers=headers, data=data)
+        response = upstox.exchange_code(code)
         response.raise_for_status()
         token_data = response.json()
 
         # Encrypt the access token
-        encrypted_token = fernet.encrypt(token_data['access_token'].encode('utf-8'))
+        encrypted_token = get_fernet().encrypt(token_data['access_token'].encode('utf-8'))
 
         # Store user data in MongoDB, updating if the role already exists
-        users_collection.update_one(
+        get_database().users.update_one(
             {'role': role},
             {
                 '$set': {
@@ -88,6 +189,7 @@ def get_token():
             },
             upsert=True
         )
+        get_token_pool().invalidate()
 
         return jsonify({"status": "success", "message": f"Token for {role} has been securely stored."})
 
@@ -103,64 +205,84 @@ def get_token():
 
 
 
-@app.route("/api/option_chain/fetch2", methods=['POST'])
+@api_bp.route("/api/option_chain/fetch2", methods=['POST'])
+@profiled('fetch_option_chain')
 def fetch_option_chain():
-    """Fetches option chain data from Upstox and stores it in the database."""
+    """Fetches option chain data from Upstox and stores it in the database.
+    When no role is given, the token pool picks the role with the most rate budget left."""
     data = request.get_json()
     role = data.get('role')
     instrument_key = data.get('instrument_key')
     expiry_date = data.get('expiry_date')
 
     # Use expiry_date from request data, not static
-    if not all([role, instrument_key, expiry_date]):
-        return jsonify({"detail": "Missing role, instrument_key, or expiry_date."}), 400
+    if not all([instrument_key, expiry_date]):
+        return jsonify({"detail": "Missing instrument_key or expiry_date."}), 400
 
-    user = users_collection.find_one({'role': role})
-    if not user:
-        return jsonify({"detail": f"Role '{role}' not found."}), 404
+    # Joining an in-flight fetch must not bypass the caller's own role
+    if role is not None:
+        try:
+            get_token_pool().check(role)
+        except NoTokenAvailable as e:
+            return jsonify({"detail": str(e)}), TOKEN_POOL_ERROR_STATUS[e.reason]
 
-    try:
-        access_token = fernet.decrypt(user['encrypted_access_token']).decode('utf-8')
-    except Exception as e:
-        return jsonify({"detail": f"Failed to decrypt access token: {e}"}), 500
+    # Concurrent fetches for the same instrument/expiry share one Upstox call, insert and metrics run
+    (result, status_code, details), shared = get_option_chain_flight().do_shared(
+        (instrument_key, expiry_date), fetch_option_chain_internal, role, instrument_key, expiry_date
+    )
+    # Callers that joined another request's fetch report that fetch's chain details
+    annotate(instrument_key=instrument_key, expiry_date=expiry_date, coalesced=shared, **details)
+    return jsonify(result), status_code
 
-    url = "https://api.upstox.com/v2/option/chain"
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {access_token}'
-    }
-    params = {
-        'instrument_key': instrument_key,
-        'expiry_date': expiry_date
-    }
+
+def fetch_option_chain_internal(role, instrument_key, expiry_date):
+    """Fetches option chain data from Upstox, stores it and recalculates metrics.
+    Returns a (response body, status code, chain details) tuple; the chain details
+    (strike_count, payload_bytes) are only filled in while profiling."""
+    details = {}
+    result, status_code = fetch_and_store_option_chain(role, instrument_key, expiry_date, details)
+    return result, status_code, details
+
+
+def fetch_and_store_option_chain(role, instrument_key, expiry_date, details):
+    token_pool = get_token_pool()
+    try:
+        role, access_token = token_pool.acquire(role)
+    except NoTokenAvailable as e:
+        return {"detail": str(e)}, TOKEN_POOL_ERROR_STATUS[e.reason]
 
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = get_upstox().get_option_chain(access_token, instrument_key, expiry_date)
+        token_pool.record_response(role, response.status_code, response.headers)
         print("Upstox response:", response.json())
         response.raise_for_status()
         option_chain_data = response.json().get('data')
+        if is_profiling():
+            details.update(strike_count=len(option_chain_data or []), payload_bytes=len(response.content))
+            # Recorded before the metrics run below so the fetched chain's figures win
+            annotate(instrument_key=instrument_key, expiry_date=expiry_date, **details)
         underlying_spot_price = response.json().get('underlying', {}).get('spot_price')
 
         if option_chain_data is None:
-            return jsonify({"detail": "No option chain data received from Upstox."}), 404
+            return {"detail": "No option chain data received from Upstox."}, 404
 
         # Store data in MongoDB
-        option_chain_collection.insert_one({
+        snapshot_id = get_database().option_chain.insert_one({
             'instrument_key': instrument_key,
             'expiry_date': expiry_date,
             'data': option_chain_data,
             'underlying_spot_price': underlying_spot_price,
             'fetched_at': datetime.now(timezone.utc)
-        })
+        }).inserted_id
 
-        # Trigger metrics calculation after storing new option chain data
-        from api_metrics_flask import calculate_metrics_internal
+        # Trigger metrics calculation for the snapshot just stored; only runs that
+        # read this same snapshot are shared, so every new snapshot gets its own metrics
         try:
-            calculate_metrics_internal(instrument_key, expiry_date)
+            calculate_snapshot_metrics(instrument_key, expiry_date, snapshot_id)
         except Exception as e:
             print(f"Error calculating metrics after option chain fetch: {e}")
 
-        return jsonify({"status": "success", "message": "Option chain data fetched and stored."})
+        return {"status": "success", "message": "Option chain data fetched and stored."}, 200
 
     except requests.exceptions.RequestException as e:
         error_detail = str(e)
@@ -168,41 +290,85 @@ def fetch_option_chain():
             error_detail = response.json().get('errors', [{}])[0].get('message', str(e))
         except Exception:
             pass
-        return jsonify({"detail": f"Failed to fetch option chain: {error_detail}"}), 400
+        return {"detail": f"Failed to fetch option chain: {error_detail}"}, 400
     except Exception as e:
-        return jsonify({"detail": f"An unexpected error occurred: {e}"}), 500
+        return {"detail": f"An unexpected error occurred: {e}"}, 500
 
 
-@app.route("/api/option_chain", methods=['GET'])
+@api_bp.route("/api/option_chain", methods=['GET'])
 def get_option_chain():
-    """Retrieves the latest option chain data from the database.""" 
+    """Retrieves the latest option chain data from the database.
+    Optional query parameters:
+    - fields: comma separated per-strike paths to return, e.g. call_options.market_data.oi
+    - strikes: only return this many strikes on each side of ATM
+    - layout: rows (default) or columnar (one array per field)
+    - format: json (default) or msgpack
+    Responses are gzip/br compressed when the client accepts it."""
     instrument_key = request.args.get('instrument_key')
     expiry_date = request.args.get('expiry_date')
 
     if not all([instrument_key, expiry_date]):
         return jsonify({"detail": "Missing instrument_key or expiry_date."}), 400
 
-    latest_data = option_chain_collection.find_one(
-        {'instrument_key': instrument_key, 'expiry_date': expiry_date},
-        sort=[('fetched_at', -1)]
-    )
+    layout = request.args.get('layout', 'rows')
+    if layout not in LAYOUTS:
+        return jsonify({"detail": f"Unsupported layout '{layout}'. Use one of: {', '.join(LAYOUTS)}"}), 400
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        strike_window = parse_strike_window(request.args.get('strikes'))
+    except EncodingError as e:
+        return jsonify({"detail": str(e)}), e.status_code
+
+    option_chain_collection = get_database().option_chain
+    snapshot_filter = {'instrument_key': instrument_key, 'expiry_date': expiry_date}
+    strikes = None
+    if strike_window is not None:
+        # Only the strike list is read to locate ATM; the window itself is cut inside MongoDB
+        header = option_chain_collection.find_one(
+            snapshot_filter,
+            {'data.strike_price': 1, 'underlying_spot_price': 1},
+            sort=[('fetched_at', -1)]
+        )
+        if not header:
+            return jsonify(None)
+        snapshot_filter = {'_id': header['_id']}
+        strikes = window_strikes(
+            [item['strike_price'] for item in header.get('data') or []],
+            header.get('underlying_spot_price'),
+            strike_window
+        )
+
+    # Field projection and strike filter are applied inside MongoDB
+    try:
+        latest_data = next(option_chain_collection.aggregate(
+            option_chain_pipeline(snapshot_filter, fields, strikes)
+        ), None)
+    except OperationFailure as e:
+        # e.g. a projection MongoDB rejects that parse_fields did not anticipate
+        return jsonify({"detail": f"Invalid option chain query: {e}"}), 400
 
     if latest_data:
         # Convert ObjectId to string for JSON serialization
         latest_data['_id'] = str(latest_data['_id'])
-        return jsonify(latest_data)
+        if layout == 'columnar':
+            latest_data['data'] = to_columnar(latest_data.get('data') or [], fields)
+        return encoded_response(latest_data)
     else:
         return jsonify(None)
 
 
-@app.route("/api/test")
+@api_bp.route("/api/auth/token_pool", methods=['GET'])
+def get_token_pool_status():
+    """Reports rate budget and validity of every pooled role."""
+    return jsonify(get_token_pool().status())
+
+
+@api_bp.route("/api/test")
 def test_route():
     return "hello"
 
 
-from api_metrics_flask import metrics_bp
-
-app.register_blueprint(metrics_bp, url_prefix='/api/metrics')
+app = create_app()
 
 if __name__ == '__main__':
     app.run(port=8000, debug=True)
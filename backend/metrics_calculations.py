@@ -1,5 +1,4 @@
 import typing
-from collections import defaultdict
 
 def classify_strikes(current_price: float, strikes: typing.List[float]) -> typing.Dict[str, typing.List[float]]:
     """
@@ -25,35 +24,144 @@ def classify_strikes(current_price: float, strikes: typing.List[float]) -> typin
         'put_otm': put_otm,
     }
 
+class MetricSpec(typing.NamedTuple):
+    """
+    Declarative definition of a windowed metric over the option chain.
+    - name: key the result is reported under
+    - aggregation: 'sum', 'mean' or 'imbalance'
+    - columns: market_data columns read by the aggregation
+      ('imbalance' expects exactly (bid_col, ask_col))
+    - itm / otm: number of ITM / OTM strikes taken around the ATM strike
+    - weight: multiplier applied to every per-strike value
+    - output_keys: optional result keys, one per column (defaults to the column names)
+    """
+    name: str
+    aggregation: str
+    columns: typing.Tuple[str, ...]
+    itm: int
+    otm: int
+    weight: float = 1.0
+    output_keys: typing.Optional[typing.Tuple[str, ...]] = None
+
+AGGREGATIONS = ('sum', 'mean', 'imbalance')
+
+METRIC_SPECS: typing.Dict[str, MetricSpec] = {}
+
+# Keys of the metrics response and stored metrics document that spec results are merged alongside
+RESERVED_METRIC_NAMES = frozenset({
+    'current_price', 'difference', 'difference_percent',
+    '_id', 'instrument_key', 'expiry_date', 'is_baseline', 'created_at', 'updated_at',
+})
+
+def register_metric_spec(spec: MetricSpec) -> MetricSpec:
+    """
+    Add (or replace) a metric spec in the registry evaluated by calculate_metrics_internal.
+    """
+    if spec.name in RESERVED_METRIC_NAMES:
+        raise ValueError(f"Metric name '{spec.name}' is reserved")
+    if spec.itm < 0 or spec.otm < 0:
+        raise ValueError(f"Metric '{spec.name}' needs non-negative itm and otm")
+    if spec.aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation '{spec.aggregation}' for metric '{spec.name}'")
+    if spec.aggregation == 'imbalance' and len(spec.columns) != 2:
+        raise ValueError(f"Imbalance metric '{spec.name}' needs exactly (bid_col, ask_col) columns")
+    if spec.output_keys is not None and len(spec.output_keys) != len(spec.columns):
+        raise ValueError(f"Metric '{spec.name}' needs one output key per column")
+    METRIC_SPECS[spec.name] = spec
+    return spec
+
+TOTALS_COLUMNS = ('oi', 'volume', 'iv', 'bid_qty', 'ask_qty')
+
+register_metric_spec(MetricSpec('totals', 'sum', TOTALS_COLUMNS, itm=5, otm=10))
+register_metric_spec(MetricSpec('bid_ask_imbalance', 'imbalance', ('bid_qty', 'ask_qty'), itm=5, otm=10, weight=0.2))
+register_metric_spec(MetricSpec('bid_ask_spread', 'mean', ('bid_price', 'ask_price'), itm=2, otm=2,
+                                output_keys=('bid_avg', 'ask_avg')))
+
+def select_window(strikes_classification: dict, side: str, itm: int, otm: int) -> typing.Set[float]:
+    """
+    Select `itm` ITM strikes + ATM + `otm` OTM strikes for one side.
+    """
+    selected = (sorted(strikes_classification[f'{side}_itm'], reverse=True)[:itm]
+                + [strikes_classification['atm']]
+                + sorted(strikes_classification[f'{side}_otm'])[:otm])
+    return set(selected)
+
+def compile_metric_specs(specs: typing.Iterable[MetricSpec], strikes_classification: dict) -> typing.Dict[float, list]:
+    """
+    Compile specs into a strike -> [(spec, side), ...] plan so that every
+    metric can be accumulated in a single pass over the chain.
+    """
+    plan = {}
+    for spec in specs:
+        for side in ('call', 'put'):
+            for strike in select_window(strikes_classification, side, spec.itm, spec.otm):
+                plan.setdefault(strike, []).append((spec, side))
+    return plan
+
+def empty_metric_result(spec: MetricSpec):
+    """
+    Result reported for a spec when the chain has no data.
+    """
+    if spec.aggregation == 'sum':
+        return {'call': {}, 'put': {}}
+    if spec.aggregation == 'imbalance':
+        return {'call': 0.0, 'put': 0.0}
+    keys = spec.output_keys or spec.columns
+    return {side: {key: 0.0 for key in keys} for side in ('call', 'put')}
+
+def evaluate_metric_specs(data: typing.List[dict], strikes_classification: dict,
+                          specs: typing.Optional[typing.Iterable[MetricSpec]] = None) -> dict:
+    """
+    Evaluate every spec (the registry by default) in one fused pass over the chain.
+    Returns dict keyed by spec name with 'call' and 'put' results.
+    """
+    specs = list(METRIC_SPECS.values() if specs is None else specs)
+    plan = compile_metric_specs(specs, strikes_classification)
+
+    sums = {spec.name: {'call': [0.0] * len(spec.columns), 'put': [0.0] * len(spec.columns)} for spec in specs}
+    counts = {spec.name: {'call': 0, 'put': 0} for spec in specs}
+
+    for item in data:
+        targets = plan.get(item['strike_price'])
+        if not targets:
+            continue
+        for spec, side in targets:
+            market_data = item[f'{side}_options']['market_data']
+            acc = sums[spec.name][side]
+            if spec.aggregation == 'imbalance':
+                bid_qty = market_data.get(spec.columns[0], 0)
+                ask_qty = market_data.get(spec.columns[1], 0)
+                denom = bid_qty + ask_qty
+                if denom != 0:
+                    acc[0] += ((bid_qty - ask_qty) / denom) * spec.weight
+            else:
+                for i, col in enumerate(spec.columns):
+                    acc[i] += market_data.get(col, 0) * spec.weight
+            counts[spec.name][side] += 1
+
+    results = {}
+    for spec in specs:
+        result = {}
+        for side in ('call', 'put'):
+            acc = sums[spec.name][side]
+            count = counts[spec.name][side]
+            if spec.aggregation == 'imbalance':
+                result[side] = acc[0]
+                continue
+            if spec.aggregation == 'mean':
+                acc = [value / count if count > 0 else 0.0 for value in acc]
+            result[side] = dict(zip(spec.output_keys or spec.columns, acc))
+        results[spec.name] = result
+    return results
+
 def calculate_totals(data: typing.List[dict], strikes_classification: dict, columns: typing.List[str]) -> dict:
     """
     Calculate totals for specified columns summing over 5 ITM + ATM + 10 OTM strikes.
     data: list of option chain data dicts with strike_price and call_options/put_options market_data.
     Returns dict with totals for call and put sides.
     """
-    totals = {
-        'call': defaultdict(float),
-        'put': defaultdict(float),
-    }
-    # Select strikes: 5 ITM + ATM + 10 OTM for each side
-    def select_strikes(itm, atm, otm):
-        selected = sorted(itm, reverse=True)[:5] + [atm] + sorted(otm)[:10]
-        return set(selected)
-
-    call_strikes = select_strikes(strikes_classification['call_itm'], strikes_classification['atm'], strikes_classification['call_otm'])
-    put_strikes = select_strikes(strikes_classification['put_itm'], strikes_classification['atm'], strikes_classification['put_otm'])
-
-    for item in data:
-        strike = item['strike_price']
-        if strike in call_strikes:
-            for col in columns:
-                val = item['call_options']['market_data'].get(col, 0)
-                totals['call'][col] += val
-        if strike in put_strikes:
-            for col in columns:
-                val = item['put_options']['market_data'].get(col, 0)
-                totals['put'][col] += val
-    return totals
+    spec = METRIC_SPECS['totals']._replace(columns=tuple(columns))
+    return evaluate_metric_specs(data, strikes_classification, [spec])['totals']
 
 def calculate_difference(current_totals: dict, baseline_totals: dict, columns: typing.List[str]) -> dict:
     """
@@ -92,72 +200,80 @@ def calculate_bid_ask_imbalance(data: typing.List[dict], strikes_classification:
     imbalance(per strike) = (bid_qty - ask_qty) / (bid_qty + ask_qty) * 0.2
     Sum over all 16 strikes for call and put sides.
     """
-    imbalance = {
-        'call': 0.0,
-        'put': 0.0,
-    }
-    def select_strikes(itm, atm, otm):
-        selected = sorted(itm, reverse=True)[:5] + [atm] + sorted(otm)[:10]
-        return set(selected)
-
-    call_strikes = select_strikes(strikes_classification['call_itm'], strikes_classification['atm'], strikes_classification['call_otm'])
-    put_strikes = select_strikes(strikes_classification['put_itm'], strikes_classification['atm'], strikes_classification['put_otm'])
-
-    for item in data:
-        strike = item['strike_price']
-        if strike in call_strikes:
-            bid_qty = item['call_options']['market_data'].get('bid_qty', 0)
-            ask_qty = item['call_options']['market_data'].get('ask_qty', 0)
-            denom = bid_qty + ask_qty
-            if denom != 0:
-                imbalance['call'] += ((bid_qty - ask_qty) / denom) * 0.2
-        if strike in put_strikes:
-            bid_qty = item['put_options']['market_data'].get('bid_qty', 0)
-            ask_qty = item['put_options']['market_data'].get('ask_qty', 0)
-            denom = bid_qty + ask_qty
-            if denom != 0:
-                imbalance['put'] += ((bid_qty - ask_qty) / denom) * 0.2
-    return imbalance
+    spec = METRIC_SPECS['bid_ask_imbalance']
+    return evaluate_metric_specs(data, strikes_classification, [spec])[spec.name]
 
 def calculate_bid_ask_spread(data: typing.List[dict], strikes_classification: dict) -> dict:
     """
     Calculate bid-ask spread for 5 strikes (2 ITM + ATM + 2 OTM).
     Average bid price and ask price over these strikes for call and put sides.
     """
-    spread = {
-        'call': {'bid_avg': 0.0, 'ask_avg': 0.0},
-        'put': {'bid_avg': 0.0, 'ask_avg': 0.0},
+    spec = METRIC_SPECS['bid_ask_spread']
+    return evaluate_metric_specs(data, strikes_classification, [spec])[spec.name]
+
+def option_iv(option: dict) -> float:
+    """
+    Implied volatility of one call/put leg. Upstox reports it under option_greeks;
+    older snapshots carry it in market_data.
+    """
+    greeks = option.get('option_greeks') or {}
+    if greeks.get('iv') is not None:
+        return greeks['iv']
+    return option.get('market_data', {}).get('iv', 0)
+
+def calculate_atm_iv(data: typing.List[dict], current_price: float) -> dict:
+    """
+    Calculate call, put and average IV at the ATM strike.
+    """
+    atm = min((item['strike_price'] for item in data), key=lambda x: abs(x - current_price))
+    item = next(item for item in data if item['strike_price'] == atm)
+    call_iv = option_iv(item['call_options'])
+    put_iv = option_iv(item['put_options'])
+    return {
+        'atm_strike': atm,
+        'call_iv': call_iv,
+        'put_iv': put_iv,
+        'atm_iv': (call_iv + put_iv) / 2,
     }
-    def select_strikes(itm, atm, otm):
-        selected = sorted(itm, reverse=True)[:2] + [atm] + sorted(otm)[:2]
-        return set(selected)
 
-    call_strikes = select_strikes(strikes_classification['call_itm'], strikes_classification['atm'], strikes_classification['call_otm'])
-    put_strikes = select_strikes(strikes_classification['put_itm'], strikes_classification['atm'], strikes_classification['put_otm'])
+def calculate_pcr(data: typing.List[dict]) -> float:
+    """
+    Calculate put-call ratio = total put OI / total call OI over all strikes.
+    """
+    call_oi = sum(item['call_options']['market_data'].get('oi', 0) for item in data)
+    put_oi = sum(item['put_options']['market_data'].get('oi', 0) for item in data)
+    if call_oi == 0:
+        return 0.0
+    return put_oi / call_oi
 
-    call_bid_sum = 0.0
-    call_ask_sum = 0.0
-    call_count = 0
-    put_bid_sum = 0.0
-    put_ask_sum = 0.0
-    put_count = 0
+def calculate_expiry_structure(data: typing.List[dict], current_price: float) -> dict:
+    """
+    Calculate the per-expiry inputs of the term structure: ATM IV, PCR and the IV smile
+    as strike -> (call_iv, put_iv).
+    """
+    return {
+        **calculate_atm_iv(data, current_price),
+        'pcr': calculate_pcr(data),
+        'smile': {item['strike_price']: (option_iv(item['call_options']), option_iv(item['put_options'])) for item in data},
+    }
 
-    for item in data:
-        strike = item['strike_price']
-        if strike in call_strikes:
-            call_bid_sum += item['call_options']['market_data'].get('bid_price', 0)
-            call_ask_sum += item['call_options']['market_data'].get('ask_price', 0)
-            call_count += 1
-        if strike in put_strikes:
-            put_bid_sum += item['put_options']['market_data'].get('bid_price', 0)
-            put_ask_sum += item['put_options']['market_data'].get('ask_price', 0)
-            put_count += 1
-
-    if call_count > 0:
-        spread['call']['bid_avg'] = call_bid_sum / call_count
-        spread['call']['ask_avg'] = call_ask_sum / call_count
-    if put_count > 0:
-        spread['put']['bid_avg'] = put_bid_sum / put_count
-        spread['put']['ask_avg'] = put_ask_sum / put_count
-
-    return spread
+def build_iv_surface(smiles: typing.Dict[str, dict]) -> dict:
+    """
+    Build an IV surface grid from expiry -> smile dicts.
+    Rows follow the sorted expiries and columns the union of strikes;
+    cells with no quote for that expiry are None.
+    """
+    expiries = sorted(smiles)
+    strikes = sorted({strike for smile in smiles.values() for strike in smile})
+    call_iv = []
+    put_iv = []
+    for expiry in expiries:
+        smile = smiles[expiry]
+        call_iv.append([smile[s][0] if s in smile else None for s in strikes])
+        put_iv.append([smile[s][1] if s in smile else None for s in strikes])
+    return {
+        'expiries': expiries,
+        'strikes': strikes,
+        'call_iv': call_iv,
+        'put_iv': put_iv,
+    }
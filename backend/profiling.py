@@ -0,0 +1,304 @@
+import functools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from flask import Blueprint, current_app, g, has_request_context, jsonify, request
+
+DEFAULT_THRESHOLD_MS = 500
+DEFAULT_INTERVAL_MS = 5
+DEFAULT_OUTPUT_DIR = 'profiles'
+DEFAULT_LOG_SIZE = 200
+# Only the newest .folded profiles are kept in output_dir
+DEFAULT_MAX_PROFILES = 100
+# Profiles waiting for the background writer; further ones are kept in memory only
+MAX_PENDING_WRITES = 100
+SLOW_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_LOG_BACKUPS = 3
+
+profiling_bp = Blueprint('profiling', __name__)
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def fold_stack(frame):
+    """Folded stack of `frame`, root first, e.g. "run (a.py:1);handler (b.py:10)"."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def format_folded(samples):
+    """Renders stack samples in the folded format read by flamegraph.pl and speedscope."""
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(samples.items()))
+
+
+class StackSampler:
+    """
+    Samples the stacks of tracked threads at a fixed interval.
+    The sampling thread only runs while at least one thread is tracked.
+    """
+
+    def __init__(self, interval_ms=DEFAULT_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._tracked = {}
+        self._running = False
+
+    def start(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._tracked[thread_id] = samples
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+        return samples
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._tracked.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._tracked:
+                    self._running = False
+                    return
+                tracked = list(self._tracked.items())
+            frames = sys._current_frames()
+            for thread_id, samples in tracked:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[fold_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class SlowRequestLog:
+    """
+    Keeps the most recent slow requests in memory (append) and appends each one
+    to a rotating JSON lines file (write).
+    """
+
+    def __init__(self, path=None, maxlen=DEFAULT_LOG_SIZE):
+        self.entries = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._logger = None
+        if path:
+            self._logger = logging.getLogger(f'{__name__}.slow_requests.{path}')
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            if not self._logger.handlers:
+                # delay: the file is only created once a slow request is logged
+                handler = RotatingFileHandler(path, maxBytes=SLOW_LOG_MAX_BYTES, backupCount=SLOW_LOG_BACKUPS,
+                                              delay=True)
+                self._logger.addHandler(handler)
+
+    def append(self, entry):
+        with self._lock:
+            self.entries.append(entry)
+
+    def write(self, entry):
+        if self._logger:
+            self._logger.info(json.dumps(entry, default=str))
+
+    def recent(self):
+        with self._lock:
+            return list(self.entries)
+
+
+class Profiler:
+    """
+    Opt-in profiler for slow requests.
+    While enabled, every request to a @profiled endpoint is stack-sampled; requests
+    slower than threshold_ms keep their samples as a .folded flamegraph file in
+    output_dir and get an entry in the slow-request log. Only the newest
+    max_profiles files are kept. allow_toggle controls whether POST /api/profiling
+    may change the settings at runtime.
+    Files are written by a background thread so recording never adds disk I/O
+    to the slow request itself.
+    """
+
+    def __init__(self, enabled=False, threshold_ms=DEFAULT_THRESHOLD_MS, interval_ms=DEFAULT_INTERVAL_MS,
+                 output_dir=DEFAULT_OUTPUT_DIR, log_size=DEFAULT_LOG_SIZE, max_profiles=DEFAULT_MAX_PROFILES,
+                 allow_toggle=False):
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self.output_dir = output_dir
+        self.max_profiles = max_profiles
+        self.allow_toggle = allow_toggle
+        self._writes = queue.Queue(maxsize=MAX_PENDING_WRITES)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self.sampler = StackSampler(interval_ms)
+        self.slow_log = SlowRequestLog(os.path.join(output_dir, 'slow_requests.jsonl') if output_dir else None,
+                                       log_size)
+
+    def profile_path(self, endpoint, started_at, duration_ms, samples):
+        if not self.output_dir or not samples:
+            return None
+        filename = f"{started_at.strftime('%Y%m%dT%H%M%S%fZ')}-{endpoint}-{int(duration_ms)}ms.folded"
+        return os.path.join(self.output_dir, filename)
+
+    def write_profile(self, endpoint, started_at, duration_ms, samples):
+        path = self.profile_path(endpoint, started_at, duration_ms, samples)
+        if path is None:
+            return None
+        with open(path, 'w') as f:
+            f.write(format_folded(samples))
+        self.prune_profiles()
+        return path
+
+    def prune_profiles(self):
+        """Deletes the oldest .folded files beyond max_profiles."""
+        profiles = []
+        for entry in os.scandir(self.output_dir):
+            if entry.name.endswith('.folded') and entry.is_file():
+                profiles.append((entry.stat().st_mtime, entry.name))
+        profiles.sort()
+        for _, name in profiles[:max(len(profiles) - self.max_profiles, 0)]:
+            try:
+                os.remove(os.path.join(self.output_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def _ensure_writer(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='profile-writer', daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            endpoint, started_at, duration_ms, samples, entry = self._writes.get()
+            try:
+                os.makedirs(self.output_dir, exist_ok=True)
+                self.write_profile(endpoint, started_at, duration_ms, samples)
+                self.slow_log.write(entry)
+            except Exception as e:
+                print(f"Failed to write profile for {endpoint}: {e}")
+            finally:
+                self._writes.task_done()
+
+    def flush(self):
+        """Blocks until every recorded profile has been written."""
+        self._writes.join()
+
+    def record(self, endpoint, started_at, duration_ms, samples, details):
+        """Adds a slow request to the in-memory log and queues its files for the background writer."""
+        profile_path = self.profile_path(endpoint, started_at, duration_ms, samples)
+        entry = {
+            'timestamp': started_at.isoformat(),
+            'endpoint': endpoint,
+            'duration_ms': round(duration_ms, 2),
+            'samples': sum(samples.values()),
+            'profile': profile_path,
+            **details,
+        }
+        self.slow_log.append(entry)
+        if self.output_dir:
+            self._ensure_writer()
+            try:
+                self._writes.put_nowait((endpoint, started_at, duration_ms, samples, entry))
+            except queue.Full:
+                # The writer is behind; never block or grow without bound on the request thread
+                entry['profile'] = None
+        return entry
+
+
+def get_profiler():
+    if not has_request_context():
+        return None
+    return current_app.extensions.get('profiler')
+
+
+def is_profiling():
+    """True while the current request is being profiled."""
+    return has_request_context() and g.get('profile_annotations') is not None
+
+
+def annotate(**fields):
+    """
+    Attaches details (e.g. strike_count, payload_bytes) to the current request's profile.
+    Details already recorded for the request are kept, so the first handler to report wins.
+    """
+    if is_profiling():
+        for key, value in fields.items():
+            g.profile_annotations.setdefault(key, value)
+
+
+def profiled(endpoint):
+    """Samples the decorated view when profiling is enabled and records it if it is slow."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            profiler = get_profiler()
+            if profiler is None or not profiler.enabled:
+                return view(*args, **kwargs)
+
+            g.profile_annotations = {}
+            thread_id = threading.get_ident()
+            started_at = datetime.now(timezone.utc)
+            started = time.perf_counter()
+            profiler.sampler.start(thread_id)
+            status_code = None
+            response = None
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+                status_code = response.status_code
+                return response
+            finally:
+                samples = profiler.sampler.stop(thread_id)
+                duration_ms = (time.perf_counter() - started) * 1000
+                if duration_ms >= profiler.threshold_ms:
+                    details = {
+                        'path': request.path,
+                        'status': status_code,
+                        'response_bytes': response.calculate_content_length() if response is not None else None,
+                        **g.profile_annotations,
+                    }
+                    profiler.record(endpoint, started_at, duration_ms, samples, details)
+                g.profile_annotations = None
+        return wrapper
+    return decorator
+
+
+@profiling_bp.route("", methods=['GET'])
+def get_profiling():
+    """Reports profiler settings and the most recent slow requests."""
+    profiler = current_app.extensions['profiler']
+    return jsonify({
+        'enabled': profiler.enabled,
+        'threshold_ms': profiler.threshold_ms,
+        'allow_toggle': profiler.allow_toggle,
+        'slow_requests': profiler.slow_log.recent(),
+    })
+
+
+@profiling_bp.route("", methods=['POST'])
+def update_profiling():
+    """Turns profiling on or off and adjusts the latency threshold at runtime.
+    Only available when PROFILING_ALLOW_TOGGLE is set."""
+    profiler = current_app.extensions['profiler']
+    if not profiler.allow_toggle:
+        return jsonify({"detail": "Runtime profiling changes are disabled. Set PROFILING_ALLOW_TOGGLE to enable them."}), 403
+    request_data = request.get_json() or {}
+    if 'threshold_ms' in request_data:
+        try:
+            profiler.threshold_ms = float(request_data['threshold_ms'])
+        except (TypeError, ValueError):
+            return jsonify({"detail": "threshold_ms must be a number"}), 400
+    if 'enabled' in request_data:
+        profiler.enabled = bool(request_data['enabled'])
+    return jsonify({'enabled': profiler.enabled, 'threshold_ms': profiler.threshold_ms})
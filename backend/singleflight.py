@@ -0,0 +1,54 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single execution.
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait and receive the same result (or the same exception).
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        return self.do_shared(key, fn, *args, **kwargs)[0]
+
+    def do_shared(self, key, fn, *args, **kwargs):
+        """Like do(), but returns (result, shared); shared is True when this caller joined another's call."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
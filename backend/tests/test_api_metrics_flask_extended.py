@@ -99,5 +99,26 @@ class TestMetricsAPIExtended(unittest.TestCase):
         response = self.app.post('/api/metrics/calculate_metrics', data=json.dumps(payload), content_type='application/json')
         self.assertEqual(response.status_code, 200)
 
+    def test_term_structure(self):
+        option_chain_collection.insert_one({
+            'instrument_key': self.instrument_key,
+            'expiry_date': '2099-09-23',
+            'underlying_spot_price': self.underlying_spot_price,
+            'data': self.option_chain_data[:2],
+            'fetched_at': datetime.now(timezone.utc)
+        })
+        response = self.app.get('/api/metrics/term_structure', query_string={'instrument_key': self.instrument_key})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data(as_text=True))
+        # The 2025 expiry in setUp has already passed
+        self.assertEqual([row['expiry_date'] for row in data['term_structure']], ['2099-09-23'])
+        self.assertEqual(data['term_structure'][0]['atm_strike'], 100)
+        self.assertIn('2099-09-23', data['pcr'])
+        self.assertEqual(data['iv_surface']['strikes'], [95, 100])
+
+    def test_term_structure_missing_instrument_key(self):
+        response = self.app.get('/api/metrics/term_structure')
+        self.assertEqual(response.status_code, 400)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import json
+import sys
+import os
+import threading
+from datetime import datetime, timezone
+from unittest import mock
+import mongomock
+from cryptography.fernet import Fernet
+from pymongo.errors import DuplicateKeyError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import api_metrics_flask
+from main import create_app
+
+class FakeUpstoxClient:
+    can_login = True
+    can_exchange_code = True
+
+    def __init__(self, option_chain):
+        self.option_chain = option_chain
+        self.option_chain_calls = 0
+
+    def login_url(self):
+        return "https://upstox.test/login"
+
+    def exchange_code(self, code):
+        return self.response({'access_token': f'token-{code}', 'user_id': 'USER1'})
+
+    def get_option_chain(self, access_token, instrument_key, expiry_date):
+        self.option_chain_calls += 1
+        return self.response({'status': 'success', 'data': self.option_chain})
+
+    def response(self, payload, status_code=200):
+        response = mock.Mock(status_code=status_code, headers={})
+        response.json.return_value = payload
+        response.raise_for_status.return_value = None
+        return response
+
+class TestAppFactory(unittest.TestCase):
+    def setUp(self):
+        self.option_chain = [
+            {
+                'strike_price': strike,
+                'call_options': {'market_data': {'oi': 10, 'volume': 100, 'bid_qty': 5, 'ask_qty': 3, 'bid_price': 1, 'ask_price': 2}},
+                'put_options': {'market_data': {'oi': 20, 'volume': 200, 'bid_qty': 7, 'ask_qty': 4, 'bid_price': 1.5, 'ask_price': 2.5}}
+            }
+            for strike in (95, 100, 105)
+        ]
+        self.upstox = FakeUpstoxClient(self.option_chain)
+        self.app = create_app({
+            'TESTING': True,
+            'MONGO_URI': None,
+            'MONGO_CLIENT': mongomock.MongoClient(),
+            'ENCRYPTION_KEY': Fernet.generate_key().decode(),
+            'UPSTOX_CLIENT': self.upstox,
+        })
+        self.client = self.app.test_client()
+        self.database = self.app.extensions['database']
+
+    def test_create_app_does_not_connect(self):
+        app = create_app({'MONGO_URI': None, 'MONGO_CLIENT': None})
+        with app.app_context():
+            with self.assertRaises(RuntimeError):
+                app.extensions['database'].db
+        self.assertEqual(app.test_client().get('/api/test').get_data(as_text=True), 'hello')
+
+    def test_login_fetch_and_metrics(self):
+        response = self.client.post('/api/auth/token', json={'code': 'abc', 'role': 'admin'})
+        self.assertEqual(response.status_code, 200)
+        stored = self.database.users.find_one({'role': 'admin'})
+        self.assertNotEqual(stored['encrypted_access_token'], b'token-abc')
+
+        response = self.client.post('/api/option_chain/fetch2', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+        self.assertEqual(self.upstox.option_chain_calls, 1)
+        self.assertEqual(self.database.option_chain.count_documents({}), 1)
+        self.assertEqual(self.database.metrics.count_documents({'is_baseline': True}), 1)
+
+        response = self.client.post('/api/metrics/calculate_metrics', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data(as_text=True))
+        self.assertAlmostEqual(data['totals']['call']['oi'], 30)
+
+    def test_apps_do_not_share_state(self):
+        other = create_app({'TESTING': True, 'MONGO_CLIENT': mongomock.MongoClient()})
+        for name in ('option_chain_flight', 'metrics_flight', 'term_structure_cache'):
+            self.assertIsNot(self.app.extensions[name], other.extensions[name])
+
+        self.database.option_chain.insert_one({
+            'instrument_key': 'KEY',
+            'expiry_date': '2099-09-16',
+            'underlying_spot_price': 100.0,
+            'data': self.option_chain,
+        })
+        response = self.client.get('/api/metrics/term_structure', query_string={'instrument_key': 'KEY'})
+        self.assertEqual(response.status_code, 200)
+        response = other.test_client().get('/api/metrics/term_structure', query_string={'instrument_key': 'KEY'})
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('Option chain data not found', response.get_data(as_text=True))
+
+    def insert_snapshot(self, oi):
+        return self.database.option_chain.insert_one({
+            'instrument_key': 'KEY',
+            'expiry_date': '2025-09-16',
+            'underlying_spot_price': 100.0,
+            'data': [
+                {'strike_price': item['strike_price'],
+                 'call_options': {'market_data': {'oi': oi}},
+                 'put_options': {'market_data': {'oi': oi}}}
+                for item in self.option_chain
+            ],
+            'fetched_at': datetime.now(timezone.utc)
+        }).inserted_id
+
+    def test_fetch_during_metrics_run_computes_new_snapshot(self):
+        self.client.post('/api/auth/token', json={'code': 'abc', 'role': 'admin'})
+        old_snapshot_id = self.insert_snapshot(oi=1)
+        entered, release = threading.Event(), threading.Event()
+        evaluate = api_metrics_flask.evaluate_metric_specs
+
+        def slow_first_evaluate(*args, **kwargs):
+            if not entered.is_set():
+                entered.set()
+                release.wait(5)
+            return evaluate(*args, **kwargs)
+
+        with mock.patch('api_metrics_flask.evaluate_metric_specs', side_effect=slow_first_evaluate):
+            # /calculate_metrics reads the old snapshot and is still running when fetch2 inserts a new one
+            slow_run = threading.Thread(target=lambda: self.app.test_client().post(
+                '/api/metrics/calculate_metrics', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'}))
+            slow_run.start()
+            self.assertTrue(entered.wait(5))
+            response = self.client.post('/api/option_chain/fetch2', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+            release.set()
+            slow_run.join(5)
+        self.assertEqual(response.status_code, 200)
+
+        new_snapshot = self.database.option_chain.find_one({'_id': {'$ne': old_snapshot_id}})
+        metrics = {doc['snapshot_id']: doc for doc in self.database.metrics.find({'is_baseline': False})}
+        self.assertEqual(set(metrics), {old_snapshot_id, new_snapshot['_id']})
+        self.assertEqual(metrics[new_snapshot['_id']]['totals']['call']['oi'], 30)
+
+    def test_baseline_is_inserted_once(self):
+        self.insert_snapshot(oi=1)
+        self.client.post('/api/metrics/calculate_metrics', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        self.insert_snapshot(oi=2)
+        response = self.client.post('/api/metrics/calculate_metrics', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        baselines = list(self.database.metrics.find({'is_baseline': True}))
+        self.assertEqual(len(baselines), 1)
+        self.assertEqual(baselines[0]['totals']['call']['oi'], 3)
+        self.assertEqual(response.get_json()['difference']['call']['oi'], 3)
+
+    def test_baseline_falls_back_to_existing_on_duplicate_key(self):
+        self.insert_snapshot(oi=2)
+        self.database.metrics.insert_one({
+            'instrument_key': 'KEY',
+            'expiry_date': '2025-09-16',
+            'is_baseline': True,
+            'totals': {'call': {'oi': 4}, 'put': {'oi': 4}},
+        })
+        with mock.patch.object(mongomock.collection.Collection, 'find_one_and_update',
+                               side_effect=DuplicateKeyError('duplicate baseline')):
+            response = self.client.post('/api/metrics/calculate_metrics', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+        self.assertEqual(response.get_json()['difference']['call']['oi'], 2)
+
+    def test_fetch_checks_role_before_joining_flight(self):
+        self.client.post('/api/auth/token', json={'code': 'abc', 'role': 'admin'})
+        with mock.patch.object(self.app.extensions['option_chain_flight'], 'do') as option_chain_flight_do:
+            response = self.client.post('/api/option_chain/fetch2', json={'role': 'nosuchrole', 'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        self.assertEqual(response.status_code, 404)
+        option_chain_flight_do.assert_not_called()
+
+    def test_fetch_without_tokens(self):
+        response = self.client.post('/api/option_chain/fetch2', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.upstox.option_chain_calls, 0)
+
+if __name__ == '__main__':
+    unittest.main()
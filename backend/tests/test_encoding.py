@@ -0,0 +1,77 @@
+import unittest
+import gzip
+import json
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import encoding
+from encoding import (
+    EncodingError,
+    encode_body,
+    negotiate_content_encoding,
+    parse_fields,
+    to_columnar,
+    window_strikes,
+)
+
+class TestEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [
+            {'strike_price': 100, 'call_options': {'market_data': {'oi': 10, 'ltp': 1.5}}},
+            {'strike_price': 105, 'call_options': {'market_data': {'oi': 15, 'ltp': 1.0}}},
+        ]
+
+    def test_parse_fields(self):
+        self.assertIsNone(parse_fields(''))
+        self.assertEqual(parse_fields('call_options.market_data.oi'), ['strike_price', 'call_options.market_data.oi'])
+        with self.assertRaises(EncodingError):
+            parse_fields('$where')
+        self.assertEqual(parse_fields('call_options.market_data.oi,call_options.market_data.oi'),
+                         ['strike_price', 'call_options.market_data.oi'])
+        for overlapping in ('call_options,call_options.market_data.oi', 'strike_price.value'):
+            with self.assertRaises(EncodingError):
+                parse_fields(overlapping)
+
+    def test_window_strikes(self):
+        strikes = [90, 95, 100, 105, 110, 115]
+        self.assertEqual(window_strikes(strikes, 103, 1), [100, 105, 110])
+        self.assertEqual(window_strikes(strikes, 91, 2), [90, 95, 100])
+        self.assertEqual(window_strikes([], 100, 2), [])
+
+    def test_to_columnar(self):
+        self.assertEqual(to_columnar(self.rows), {
+            'strike_price': [100, 105],
+            'call_options.market_data.oi': [10, 15],
+            'call_options.market_data.ltp': [1.5, 1.0],
+        })
+        self.assertEqual(to_columnar(self.rows, ['strike_price', 'put_options.market_data.oi']),
+                         {'strike_price': [100, 105], 'put_options.market_data.oi': [None, None]})
+
+    def test_negotiate_content_encoding(self):
+        self.assertEqual(negotiate_content_encoding('gzip, deflate'), 'gzip')
+        self.assertIsNone(negotiate_content_encoding('gzip;q=0, identity'))
+        self.assertIsNone(negotiate_content_encoding(None))
+
+    def test_encode_body_compresses_large_json(self):
+        payload = {'data': self.rows * 100}
+        body, headers = encode_body(payload, 'json', 'gzip')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(body)), payload)
+
+        body, headers = encode_body({'small': True}, 'json', 'gzip')
+        self.assertNotIn('Content-Encoding', headers)
+
+    @unittest.skipIf(encoding.msgpack is None, "msgpack not installed")
+    def test_encode_body_msgpack(self):
+        body, headers = encode_body({'data': self.rows}, 'msgpack')
+        self.assertEqual(headers['Content-Type'], 'application/msgpack')
+        self.assertEqual(encoding.msgpack.unpackb(body), {'data': self.rows})
+
+    def test_unsupported_format(self):
+        with self.assertRaises(EncodingError):
+            encode_body({}, 'xml')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,13 @@ from backend.metrics_calculations import (
     calculate_difference_percent,
     calculate_bid_ask_imbalance,
     calculate_bid_ask_spread,
+    MetricSpec,
+    build_iv_surface,
+    calculate_atm_iv,
+    calculate_pcr,
+    evaluate_metric_specs,
+    METRIC_SPECS,
+    register_metric_spec,
 )
 
 class TestMetricsCalculations(unittest.TestCase):
@@ -77,5 +84,47 @@ class TestMetricsCalculations(unittest.TestCase):
         self.assertTrue('call' in spread)
         self.assertTrue('put' in spread)
 
+    def test_evaluate_metric_specs_matches_individual_metrics(self):
+        results = evaluate_metric_specs(self.sample_data, self.strikes_classification)
+        self.assertEqual(results['totals'], calculate_totals(self.sample_data, self.strikes_classification, self.columns))
+        self.assertEqual(results['bid_ask_imbalance'], calculate_bid_ask_imbalance(self.sample_data, self.strikes_classification))
+        self.assertEqual(results['bid_ask_spread'], calculate_bid_ask_spread(self.sample_data, self.strikes_classification))
+
+    def test_evaluate_custom_metric_spec(self):
+        spec = MetricSpec('atm_oi', 'sum', ('oi',), itm=0, otm=0)
+        results = evaluate_metric_specs(self.sample_data, self.strikes_classification, [spec])
+        self.assertAlmostEqual(results['atm_oi']['call']['oi'], 10)
+        self.assertAlmostEqual(results['atm_oi']['put']['oi'], 20)
+
+    def test_register_metric_spec_rejects_unknown_aggregation(self):
+        with self.assertRaises(ValueError):
+            register_metric_spec(MetricSpec('bad', 'median', ('oi',), itm=1, otm=1))
+
+    def test_register_metric_spec_rejects_reserved_names_and_negative_windows(self):
+        for name in ('difference', 'current_price', 'is_baseline', 'instrument_key'):
+            with self.assertRaises(ValueError):
+                register_metric_spec(MetricSpec(name, 'sum', ('oi',), itm=1, otm=1))
+        with self.assertRaises(ValueError):
+            register_metric_spec(MetricSpec('bad_window', 'sum', ('oi',), itm=-1, otm=1))
+        self.assertNotIn('bad_window', METRIC_SPECS)
+
+    def test_calculate_atm_iv(self):
+        atm_iv = calculate_atm_iv(self.sample_data, 101)
+        self.assertEqual(atm_iv['atm_strike'], 100)
+        self.assertAlmostEqual(atm_iv['atm_iv'], 0.25)
+
+    def test_calculate_pcr(self):
+        self.assertAlmostEqual(calculate_pcr(self.sample_data), 45 / 25)
+
+    def test_build_iv_surface(self):
+        surface = build_iv_surface({
+            '2025-09-23': {100: (0.2, 0.3), 105: (0.25, 0.35)},
+            '2025-09-16': {100: (0.1, 0.2)},
+        })
+        self.assertEqual(surface['expiries'], ['2025-09-16', '2025-09-23'])
+        self.assertEqual(surface['strikes'], [100, 105])
+        self.assertEqual(surface['call_iv'], [[0.1, None], [0.2, 0.25]])
+        self.assertEqual(surface['put_iv'], [[0.2, None], [0.3, 0.35]])
+
 if __name__ == '__main__':
     unittest.main()
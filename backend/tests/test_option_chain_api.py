@@ -0,0 +1,84 @@
+import unittest
+import gzip
+import json
+import sys
+import os
+from datetime import datetime, timezone
+from unittest import mock
+import mongomock
+from pymongo.errors import OperationFailure
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import create_app
+
+class TestOptionChainAPI(unittest.TestCase):
+    def setUp(self):
+        app = create_app({'TESTING': True, 'MONGO_CLIENT': mongomock.MongoClient()})
+        self.app = app.test_client()
+        option_chain_collection = app.extensions['database'].option_chain
+
+        self.instrument_key = "TEST_INSTRUMENT"
+        self.expiry_date = "2025-09-16"
+        self.params = {'instrument_key': self.instrument_key, 'expiry_date': self.expiry_date}
+        option_chain_collection.insert_one({
+            'instrument_key': self.instrument_key,
+            'expiry_date': self.expiry_date,
+            'underlying_spot_price': 112.0,
+            'data': [
+                {
+                    'strike_price': strike,
+                    'call_options': {'market_data': {'oi': strike, 'ltp': 1.0, 'bid_qty': 5}},
+                    'put_options': {'market_data': {'oi': strike * 2, 'ltp': 2.0, 'bid_qty': 7}}
+                }
+                for strike in range(90, 135, 5)
+            ],
+            'fetched_at': datetime.now(timezone.utc)
+        })
+
+    def get(self, headers=None, **params):
+        return self.app.get('/api/option_chain', query_string={**self.params, **params}, headers=headers or {})
+
+    def test_full_snapshot(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(data['data']), 9)
+        self.assertIn('ltp', data['data'][0]['call_options']['market_data'])
+
+    def test_field_projection_and_strike_window(self):
+        response = self.get(fields='call_options.market_data.oi', strikes='1')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual([item['strike_price'] for item in data['data']], [105, 110, 115])
+        self.assertEqual(data['data'][0], {'strike_price': 105, 'call_options': {'market_data': {'oi': 105}}})
+        self.assertEqual(data['underlying_spot_price'], 112.0)
+
+    def test_columnar_layout(self):
+        response = self.get(fields='put_options.market_data.oi', strikes='0', layout='columnar')
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(data['data'], {'strike_price': [110], 'put_options.market_data.oi': [220]})
+
+    def test_gzip_compression(self):
+        response = self.get(headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        data = json.loads(gzip.decompress(response.get_data()))
+        self.assertEqual(len(data['data']), 9)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get(strikes='-1').status_code, 400)
+        self.assertEqual(self.get(layout='xml').status_code, 400)
+        self.assertEqual(self.get(format='xml').status_code, 400)
+        response = self.get(fields='call_options,call_options.market_data.oi')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('overlaps', response.get_json()['detail'])
+
+    def test_rejected_projection_returns_400(self):
+        with mock.patch.object(mongomock.collection.Collection, 'aggregate',
+                               side_effect=OperationFailure('Path collision at call_options')):
+            response = self.get(fields='call_options.market_data.oi')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Path collision', response.get_json()['detail'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+import json
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from unittest import mock
+import mongomock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import create_app
+from profiling import StackSampler, format_folded
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+class TestStackSampler(unittest.TestCase):
+
+    def test_samples_tracked_thread(self):
+        sampler = StackSampler(interval_ms=1)
+        sampler.start(threading.get_ident())
+        busy_wait(0.05)
+        samples = sampler.stop(threading.get_ident())
+        self.assertTrue(samples)
+        self.assertTrue(any('busy_wait (test_profiling.py' in stack for stack in samples))
+
+    def test_format_folded(self):
+        self.assertEqual(format_folded(Counter({'a;b': 2, 'a': 1})), "a 1\na;b 2\n")
+
+class TestProfilingHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.app = create_app({
+            'TESTING': True,
+            'MONGO_CLIENT': mongomock.MongoClient(),
+            'PROFILING_ENABLED': True,
+            'PROFILING_THRESHOLD_MS': 0,
+            'PROFILING_INTERVAL_MS': 1,
+            'PROFILING_DIR': self.output_dir,
+            'PROFILING_MAX_FILES': 2,
+            'PROFILING_ALLOW_TOGGLE': True,
+        })
+        self.client = self.app.test_client()
+        self.app.extensions['database'].option_chain.insert_one({
+            'instrument_key': 'KEY',
+            'expiry_date': '2025-09-16',
+            'underlying_spot_price': 100.0,
+            'data': [
+                {
+                    'strike_price': strike,
+                    'call_options': {'market_data': {'oi': 10, 'bid_qty': 5, 'ask_qty': 3}},
+                    'put_options': {'market_data': {'oi': 20, 'bid_qty': 7, 'ask_qty': 4}}
+                }
+                for strike in (95, 100, 105)
+            ],
+            'fetched_at': datetime.now(timezone.utc)
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_slow_request_is_recorded(self):
+        response = self.client.post('/api/metrics/calculate_metrics', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        self.assertEqual(response.status_code, 200)
+
+        entries = self.client.get('/api/profiling').get_json()['slow_requests']
+        self.assertEqual(len(entries), 1)
+        entry = entries[0]
+        self.assertEqual(entry['endpoint'], 'calculate_metrics')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['strike_count'], 3)
+        self.assertGreater(entry['payload_bytes'], 0)
+        self.assertFalse(entry['coalesced'])
+
+        self.app.extensions['profiler'].flush()
+        if entry['profile'] is not None:
+            # Very fast requests may finish before the first sample is taken
+            self.assertTrue(os.path.exists(entry['profile']))
+        with open(os.path.join(self.output_dir, 'slow_requests.jsonl')) as f:
+            self.assertEqual(json.loads(f.readline())['endpoint'], 'calculate_metrics')
+
+    def test_only_newest_profiles_are_kept(self):
+        profiler = self.app.extensions['profiler']
+        paths = []
+        for i in range(4):
+            started_at = datetime(2025, 9, 16, 9, 15, i, tzinfo=timezone.utc)
+            paths.append(profiler.record('calculate_metrics', started_at, 600, Counter({'main;handler': 3}), {})['profile'])
+            profiler.flush()
+            time.sleep(0.01)
+        profiles = sorted(name for name in os.listdir(self.output_dir) if name.endswith('.folded'))
+        self.assertEqual(profiles, [os.path.basename(path) for path in paths[-2:]])
+
+    def test_coalesced_fetch_reports_leader_chain(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def slow_fetch(role, instrument_key, expiry_date, details):
+            details.update(strike_count=3, payload_bytes=1024)
+            entered.set()
+            release.wait(5)
+            return {"status": "success"}, 200
+
+        def fetch():
+            self.app.test_client().post('/api/option_chain/fetch2', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+
+        with mock.patch('main.fetch_and_store_option_chain', side_effect=slow_fetch):
+            leader = threading.Thread(target=fetch)
+            leader.start()
+            self.assertTrue(entered.wait(5))
+            follower = threading.Thread(target=fetch)
+            follower.start()
+            # Give the follower time to join the leader's in-flight fetch
+            time.sleep(0.1)
+            release.set()
+            leader.join(5)
+            follower.join(5)
+
+        entries = self.client.get('/api/profiling').get_json()['slow_requests']
+        self.assertEqual(sorted(entry['coalesced'] for entry in entries), [False, True])
+        for entry in entries:
+            self.assertEqual(entry['endpoint'], 'fetch_option_chain')
+            self.assertEqual((entry['strike_count'], entry['payload_bytes']), (3, 1024))
+
+    def test_runtime_toggle_requires_config(self):
+        app = create_app({'TESTING': True, 'MONGO_CLIENT': mongomock.MongoClient(), 'PROFILING_DIR': self.output_dir})
+        response = app.test_client().post('/api/profiling', json={'enabled': True, 'threshold_ms': 0})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(app.extensions['profiler'].enabled)
+
+    def test_fast_requests_and_disabled_profiler_are_not_recorded(self):
+        self.client.post('/api/profiling', json={'threshold_ms': 60000})
+        self.client.post('/api/metrics/calculate_metrics', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        self.client.post('/api/profiling', json={'enabled': False, 'threshold_ms': 0})
+        self.client.post('/api/metrics/calculate_metrics', json={'instrument_key': 'KEY', 'expiry_date': '2025-09-16'})
+        self.assertEqual(self.client.get('/api/profiling').get_json()['slow_requests'], [])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'slow_requests.jsonl')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import threading
+import time
+from backend.singleflight import SingleFlight
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = 0
+        self.release = threading.Event()
+
+    def slow_call(self, value):
+        self.calls += 1
+        self.release.wait(5)
+        return value
+
+    def run_concurrently(self, count, fn):
+        # The first thread becomes the leader; the rest start once it is in flight
+        results = []
+        errors = []
+        def worker():
+            try:
+                results.append(self.flight.do('key', fn, 'result'))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        threads[0].start()
+        while not self.flight.in_flight('key'):
+            pass
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_share_one_execution(self):
+        results, errors = self.run_concurrently(5, self.slow_call)
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(errors, [])
+        self.assertEqual(self.calls, 1)
+        self.assertFalse(self.flight.in_flight('key'))
+
+    def test_error_is_shared_and_not_cached(self):
+        def failing_call(value):
+            self.calls += 1
+            self.release.wait(5)
+            raise ValueError(value)
+        results, errors = self.run_concurrently(3, failing_call)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flight.do('key', lambda: 'fresh'), 'fresh')
+
+    def test_do_shared_reports_joined_callers(self):
+        shared = []
+        leader = threading.Thread(target=lambda: shared.append(self.flight.do_shared('key', self.slow_call, 'result')))
+        leader.start()
+        while not self.flight.in_flight('key'):
+            pass
+        follower = threading.Thread(target=lambda: shared.append(self.flight.do_shared('key', self.slow_call, 'result')))
+        follower.start()
+        time.sleep(0.1)
+        self.release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(sorted(shared), [('result', False), ('result', True)])
+        self.assertEqual(self.calls, 1)
+
+    def test_different_keys_do_not_coalesce(self):
+        self.assertEqual(self.flight.do('a', lambda: 1), 1)
+        self.assertEqual(self.flight.do('b', lambda: 2), 2)
+
+if __name__ == '__main__':
+    unittest.main()
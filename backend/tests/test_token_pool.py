@@ -0,0 +1,149 @@
+import unittest
+import threading
+from datetime import datetime, timezone
+from backend.token_pool import MISSING_ROLE_RELOAD_SECONDS, NoTokenAvailable, TokenPool, token_expiry
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestTokenPool(unittest.TestCase):
+
+    def setUp(self):
+        # 2025-09-15 10:00 IST
+        issued_at = datetime(2025, 9, 15, 4, 30, tzinfo=timezone.utc)
+        self.clock = FakeClock(issued_at.timestamp())
+        self.tokens = [('admin', 'token-a', issued_at), ('user', 'token-b', issued_at)]
+        self.pool = TokenPool(lambda: self.tokens, requests_per_window=3, window_seconds=60, clock=self.clock)
+
+    def test_token_expiry_is_next_0330_ist(self):
+        issued_at = datetime(2025, 9, 15, 4, 30, tzinfo=timezone.utc)
+        expected = datetime(2025, 9, 15, 22, 0, tzinfo=timezone.utc).timestamp()
+        self.assertEqual(token_expiry(issued_at), expected)
+        self.assertIsNone(token_expiry(None))
+
+    def test_token_issued_after_midnight_ist_expires_next_day(self):
+        # 2025-09-16 02:00 IST expires 2025-09-17 03:30 IST, not 03:30 the same morning
+        issued_at = datetime(2025, 9, 15, 20, 30, tzinfo=timezone.utc)
+        expected = datetime(2025, 9, 16, 22, 0, tzinfo=timezone.utc).timestamp()
+        self.assertEqual(token_expiry(issued_at), expected)
+
+        self.clock.now = issued_at.timestamp() + 3600
+        self.tokens = [('admin', 'token-a', issued_at)]
+        self.pool.check('admin')
+        self.assertEqual(self.pool.acquire('admin'), ('admin', 'token-a'))
+
+    def test_acquire_balances_across_roles(self):
+        roles = [self.pool.acquire()[0] for _ in range(6)]
+        self.assertEqual(sorted(roles), ['admin'] * 3 + ['user'] * 3)
+        with self.assertRaises(NoTokenAvailable) as ctx:
+            self.pool.acquire()
+        self.assertEqual(ctx.exception.reason, 'rate_limited')
+
+    def test_budget_resets_after_window(self):
+        for _ in range(6):
+            self.pool.acquire()
+        self.clock.now += 61
+        self.assertIn(self.pool.acquire()[0], ('admin', 'user'))
+
+    def test_rate_limit_headers_and_429(self):
+        self.pool.acquire('admin')
+        self.pool.record_response('admin', 200, {'X-RateLimit-Remaining': '0'})
+        self.assertEqual(self.pool.acquire(), ('user', 'token-b'))
+        self.pool.record_response('user', 429, {'Retry-After': '120'})
+        with self.assertRaises(NoTokenAvailable):
+            self.pool.acquire('user')
+        self.clock.now += 121
+        self.assertEqual(self.pool.acquire('user'), ('user', 'token-b'))
+
+    def test_unauthorized_token_is_skipped_until_replaced(self):
+        self.pool.acquire('admin')
+        self.pool.record_response('admin', 401)
+        with self.assertRaises(NoTokenAvailable) as ctx:
+            self.pool.acquire('admin')
+        self.assertEqual(ctx.exception.reason, 'invalid')
+        self.tokens[0] = ('admin', 'token-c', datetime.fromtimestamp(self.clock.now, timezone.utc))
+        self.clock.now += MISSING_ROLE_RELOAD_SECONDS
+        self.assertEqual(self.pool.acquire('admin'), ('admin', 'token-c'))
+
+    def test_expired_tokens_are_not_handed_out(self):
+        self.clock.now = datetime(2025, 9, 15, 21, 58, tzinfo=timezone.utc).timestamp()
+        with self.assertRaises(NoTokenAvailable) as ctx:
+            self.pool.acquire('admin')
+        self.assertEqual(ctx.exception.reason, 'expired')
+        self.assertFalse(any(entry['available'] for entry in self.pool.status()))
+        with self.assertRaises(NoTokenAvailable) as ctx:
+            self.pool.acquire()
+        self.assertEqual(ctx.exception.reason, 'expired')
+
+    def test_pool_reason_when_no_token_is_usable(self):
+        self.pool.status()
+        for role in ('admin', 'user'):
+            self.pool.record_response(role, 401)
+        with self.assertRaises(NoTokenAvailable) as ctx:
+            self.pool.acquire()
+        self.assertEqual(ctx.exception.reason, 'invalid')
+
+        empty_pool = TokenPool(lambda: [], clock=self.clock)
+        with self.assertRaises(NoTokenAvailable) as ctx:
+            empty_pool.acquire()
+        self.assertEqual(ctx.exception.reason, 'not_found')
+
+    def test_unknown_role(self):
+        with self.assertRaises(NoTokenAvailable) as ctx:
+            self.pool.acquire('missing')
+        self.assertEqual(ctx.exception.reason, 'not_found')
+
+    def test_check_role_does_not_reserve_budget(self):
+        for _ in range(3):
+            self.pool.check('admin')
+        self.assertEqual(self.pool.acquire('admin'), ('admin', 'token-a'))
+        with self.assertRaises(NoTokenAvailable) as ctx:
+            self.pool.check('missing')
+        self.assertEqual(ctx.exception.reason, 'not_found')
+        self.pool.record_response('user', 401)
+        with self.assertRaises(NoTokenAvailable) as ctx:
+            self.pool.check('user')
+        self.assertEqual(ctx.exception.reason, 'invalid')
+
+    def test_missing_role_reloads_are_rate_limited(self):
+        loads = []
+        pool = TokenPool(lambda: loads.append(1) or self.tokens, clock=self.clock)
+        for _ in range(3):
+            with self.assertRaises(NoTokenAvailable):
+                pool.check('missing')
+            with self.assertRaises(NoTokenAvailable):
+                pool.acquire('missing')
+        self.assertEqual(len(loads), 1)
+        self.clock.now += MISSING_ROLE_RELOAD_SECONDS
+        self.tokens.append(('missing', 'token-m', None))
+        self.assertEqual(pool.acquire('missing'), ('missing', 'token-m'))
+        self.assertEqual(len(loads), 2)
+
+    def test_reload_does_not_block_loaded_roles(self):
+        loading, release = threading.Event(), threading.Event()
+
+        def slow_loader():
+            if self.pool_loaded:
+                loading.set()
+                release.wait(5)
+            return self.tokens
+
+        self.pool_loaded = False
+        pool = TokenPool(slow_loader, clock=self.clock)
+        pool.acquire('admin')
+        self.pool_loaded = True
+        pool.invalidate()
+        reload_thread = threading.Thread(target=pool.status)
+        reload_thread.start()
+        self.assertTrue(loading.wait(5))
+        # Served from the already loaded tokens while the reload is still running
+        self.assertEqual(pool.acquire('user'), ('user', 'token-b'))
+        release.set()
+        reload_thread.join(5)
+
+if __name__ == '__main__':
+    unittest.main()
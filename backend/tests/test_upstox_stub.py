@@ -0,0 +1,108 @@
+import unittest
+import sys
+import os
+import threading
+import time
+from flask import Flask
+from werkzeug.serving import make_server
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from upstox_stub import create_stub_app, generate_option_chain
+from load_test import parse_list, percentile, run_load
+
+class TestUpstoxStub(unittest.TestCase):
+    def setUp(self):
+        self.params = {'instrument_key': 'NSE_INDEX|Nifty 50', 'expiry_date': '2025-09-16'}
+        self.headers = {'Authorization': 'Bearer stub-token'}
+
+    def test_option_chain_is_deterministic(self):
+        first = create_stub_app(strikes=20, seed=7).test_client()
+        second = create_stub_app(strikes=20, seed=7).test_client()
+        for _ in range(3):
+            a = first.get('/v2/option/chain', query_string=self.params, headers=self.headers)
+            b = second.get('/v2/option/chain', query_string=self.params, headers=self.headers)
+            self.assertEqual(a.status_code, 200)
+            self.assertEqual(a.get_json(), b.get_json())
+        self.assertEqual(len(a.get_json()['data']), 20)
+
+    def test_chain_drifts_between_ticks(self):
+        chain = generate_option_chain('KEY', '2025-09-16', 10, tick=0)
+        self.assertNotEqual(chain, generate_option_chain('KEY', '2025-09-16', 10, tick=1))
+        self.assertIn('option_greeks', chain['data'][0]['call_options'])
+
+    def test_error_rates(self):
+        client = create_stub_app(rate_limit_rate=1.0).test_client()
+        response = client.get('/v2/option/chain', query_string=self.params, headers=self.headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+        client = create_stub_app(error_rate=1.0).test_client()
+        response = client.get('/v2/option/chain', query_string=self.params, headers=self.headers)
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('errors', response.get_json())
+
+    def test_per_token_rate_budget(self):
+        now = [0.0]
+        client = create_stub_app(strikes=5, rate_limit_per_token=2, rate_limit_window_s=60, clock=lambda: now[0]).test_client()
+        statuses = []
+        for _ in range(3):
+            response = client.get('/v2/option/chain', query_string=self.params, headers=self.headers)
+            statuses.append((response.status_code, response.headers['X-RateLimit-Remaining']))
+        self.assertEqual(statuses, [(200, '1'), (200, '0'), (429, '0')])
+        self.assertEqual(response.headers['Retry-After'], '60')
+
+        other = client.get('/v2/option/chain', query_string=self.params, headers={'Authorization': 'Bearer other'})
+        self.assertEqual(other.status_code, 200)
+
+        now[0] = 61
+        response = client.get('/v2/option/chain', query_string=self.params, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(float(response.headers['X-RateLimit-Reset']), 60)
+
+    def test_missing_bearer_token(self):
+        client = create_stub_app().test_client()
+        response = client.get('/v2/option/chain', query_string=self.params)
+        self.assertEqual(response.status_code, 401)
+
+    def test_token_exchange(self):
+        client = create_stub_app().test_client()
+        response = client.post('/v2/login/authorization/token', data={'code': 'abc', 'grant_type': 'authorization_code'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['access_token'], 'stub-token-abc')
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    def test_run_load_counts_queueing(self):
+        app = Flask(__name__)
+
+        @app.route("/api/option_chain/fetch2", methods=['POST'])
+        def fetch():
+            time.sleep(0.05)
+            return {'status': 'success'}
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            # One worker and 100 rps against a 50 ms endpoint: later requests wait for the worker
+            results, _ = run_load(f"http://127.0.0.1:{server.server_port}", ['fetch'], rps=100, duration=0.1,
+                                  instrument_keys=['KEY'], expiry_dates=['2025-09-16'], concurrency=1)
+        finally:
+            server.shutdown()
+        latencies = results['fetch']['latencies']
+        self.assertEqual(len(latencies), 10)
+        self.assertGreater(max(latencies), 0.3)
+
+    def test_run_load_rejects_unknown_endpoints(self):
+        with self.assertRaises(ValueError):
+            run_load('http://127.0.0.1:1', ['fetch', 'fecth'], rps=1, duration=1,
+                     instrument_keys=['KEY'], expiry_dates=['2025-09-16'])
+
+    def test_parse_list(self):
+        self.assertEqual(parse_list('NSE_INDEX|Nifty 50, NSE_INDEX|Nifty Bank,'), ['NSE_INDEX|Nifty 50', 'NSE_INDEX|Nifty Bank'])
+
+if __name__ == '__main__':
+    unittest.main()
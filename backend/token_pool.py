@@ -0,0 +1,271 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Upstox access tokens expire at 03:30 IST on the day after they are issued
+IST = timezone(timedelta(hours=5, minutes=30))
+TOKEN_EXPIRY_HOUR = 3
+TOKEN_EXPIRY_MINUTE = 30
+
+# Upstox standard API limit per user
+DEFAULT_REQUESTS_PER_WINDOW = 500
+DEFAULT_WINDOW_SECONDS = 60
+DEFAULT_RETRY_AFTER_SECONDS = 60
+
+# Tokens this close to expiry are no longer handed out
+EXPIRY_MARGIN_SECONDS = 300
+
+# Tokens are re-read periodically so logins handled by other workers are picked up
+RELOAD_INTERVAL_SECONDS = 60
+
+# Unknown or rejected roles trigger an early reload at most this often
+MISSING_ROLE_RELOAD_SECONDS = 5
+
+
+class NoTokenAvailable(Exception):
+    """
+    Raised when no token can be handed out. `reason` is one of
+    'not_found', 'invalid', 'expired' or 'rate_limited'.
+    """
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def token_expiry(issued_at):
+    """
+    Returns the UTC timestamp at which a token issued at `issued_at` expires,
+    or None when the issue time is unknown.
+    """
+    if issued_at is None:
+        return None
+    if issued_at.tzinfo is None:
+        # pymongo returns naive UTC datetimes
+        issued_at = issued_at.replace(tzinfo=timezone.utc)
+    issued_ist = issued_at.astimezone(IST)
+    # Always the next calendar day, even for tokens issued between 00:00 and 03:30 IST
+    expiry = issued_ist.replace(hour=TOKEN_EXPIRY_HOUR, minute=TOKEN_EXPIRY_MINUTE, second=0, microsecond=0)
+    return (expiry + timedelta(days=1)).timestamp()
+
+
+class TokenState:
+    def __init__(self, role, access_token, expires_at, budget):
+        self.role = role
+        self.access_token = access_token
+        self.expires_at = expires_at
+        self.remaining = budget
+        self.window_reset_at = 0.0
+        self.cooldown_until = 0.0
+        self.invalid = False
+        self.last_used_at = 0.0
+
+
+class TokenPool:
+    """
+    Pool of Upstox access tokens, one per stored role.
+    Tracks each role's remaining rate budget from response headers and 429s,
+    skips tokens that are expired, about to expire or rejected with 401,
+    and hands out the token with the most budget left.
+
+    loader() must return an iterable of (role, access_token, issued_at) tuples.
+    It is called outside the pool lock, so a slow load never blocks acquire()
+    for roles that are already loaded.
+    """
+
+    def __init__(self, loader, requests_per_window=DEFAULT_REQUESTS_PER_WINDOW,
+                 window_seconds=DEFAULT_WINDOW_SECONDS, clock=time.time):
+        self._loader = loader
+        self._requests_per_window = requests_per_window
+        self._window_seconds = window_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Serializes loader calls so concurrent callers share one load
+        self._load_lock = threading.Lock()
+        self._tokens = {}
+        self._loaded_at = None
+        self._invalidations = 0
+        self._load_count = 0
+
+    def invalidate(self):
+        """Reload tokens from the loader on next use (e.g. after a new login)."""
+        with self._lock:
+            self._loaded_at = None
+            self._invalidations += 1
+
+    def _is_stale(self, max_age):
+        return self._loaded_at is None or self._clock() - self._loaded_at >= max_age
+
+    def _ensure_loaded(self, max_age=RELOAD_INTERVAL_SECONDS, wait=False):
+        """
+        Reloads tokens when the last load is older than `max_age`. Must be called without the pool lock.
+        Once tokens have been loaded, callers keep using them while another caller reloads
+        unless `wait` is set.
+        """
+        with self._lock:
+            if not self._is_stale(max_age):
+                return
+            wait = wait or self._load_count == 0
+        if not self._load_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                # Another caller may have finished a load while this one waited
+                if not self._is_stale(max_age):
+                    return
+                invalidations = self._invalidations
+            loaded = list(self._loader())
+            with self._lock:
+                self._apply(loaded)
+                self._load_count += 1
+                if self._invalidations != invalidations:
+                    # invalidate() ran during the load, which may have missed the new login
+                    self._loaded_at = None
+        finally:
+            self._load_lock.release()
+
+    def _refresh_missing(self, role=None):
+        """Early reload when `role` (or, without a role, every role) is missing or rejected."""
+        with self._lock:
+            if role is None:
+                missing = not self._tokens
+            else:
+                state = self._tokens.get(role)
+                missing = state is None or state.invalid
+        if missing:
+            # The role may have logged in since the last load
+            self._ensure_loaded(MISSING_ROLE_RELOAD_SECONDS, wait=True)
+
+    def _apply(self, loaded):
+        tokens = {}
+        for role, access_token, issued_at in loaded:
+            state = TokenState(role, access_token, token_expiry(issued_at), self._requests_per_window)
+            previous = self._tokens.get(role)
+            if previous is not None and previous.access_token == access_token:
+                # Same token: keep its rate budget and validity
+                state = previous
+            tokens[role] = state
+        self._tokens = tokens
+        self._loaded_at = self._clock()
+
+    def _roll_window(self, state, now):
+        if now >= state.window_reset_at:
+            state.remaining = self._requests_per_window
+            state.window_reset_at = now + self._window_seconds
+
+    def _unavailable_reason(self, state, now):
+        if state.invalid:
+            return 'invalid'
+        if state.expires_at is not None and now >= state.expires_at - EXPIRY_MARGIN_SECONDS:
+            return 'expired'
+        if now < state.cooldown_until:
+            return 'rate_limited'
+        self._roll_window(state, now)
+        if state.remaining <= 0:
+            return 'rate_limited'
+        return None
+
+    def _role_state(self, role):
+        state = self._tokens.get(role)
+        if state is None:
+            raise NoTokenAvailable(f"Role '{role}' not found.", 'not_found')
+        return state
+
+    def check(self, role):
+        """
+        Raise NoTokenAvailable unless `role` has a stored token that is valid
+        and not about to expire. Does not reserve any rate budget.
+        """
+        self._ensure_loaded()
+        self._refresh_missing(role)
+        with self._lock:
+            state = self._role_state(role)
+            if state.invalid:
+                raise NoTokenAvailable(f"Token for role '{role}' is invalid.", 'invalid')
+            if state.expires_at is not None and self._clock() >= state.expires_at - EXPIRY_MARGIN_SECONDS:
+                raise NoTokenAvailable(f"Token for role '{role}' is expired.", 'expired')
+
+    def acquire(self, role=None):
+        """
+        Reserve one request for `role`, or for the best available role when
+        role is None. Returns (role, access_token); raises NoTokenAvailable.
+        """
+        self._ensure_loaded()
+        self._refresh_missing(role)
+        with self._lock:
+            now = self._clock()
+            if role is not None:
+                state = self._role_state(role)
+                reason = self._unavailable_reason(state, now)
+                if reason is not None:
+                    raise NoTokenAvailable(f"Token for role '{role}' is {reason.replace('_', ' ')}.", reason)
+                candidates = [state]
+            else:
+                if not self._tokens:
+                    raise NoTokenAvailable("No Upstox login stored.", 'not_found')
+                reasons = {state: self._unavailable_reason(state, now) for state in self._tokens.values()}
+                candidates = [state for state, reason in reasons.items() if reason is None]
+                if not candidates:
+                    raise self._pool_unavailable(set(reasons.values()))
+            state = max(candidates, key=lambda s: (s.remaining, -s.last_used_at))
+            state.remaining -= 1
+            state.last_used_at = now
+            return state.role, state.access_token
+
+    @staticmethod
+    def _pool_unavailable(reasons):
+        # Waiting only helps when some token is rate limited; otherwise a new login is needed
+        if 'rate_limited' in reasons:
+            return NoTokenAvailable("No valid Upstox token with remaining rate budget.", 'rate_limited')
+        if 'expired' in reasons:
+            return NoTokenAvailable("Every stored Upstox token has expired.", 'expired')
+        return NoTokenAvailable("Every stored Upstox token was rejected as invalid.", 'invalid')
+
+    def record_response(self, role, status_code, headers=None):
+        """Update a role's budget and validity from an Upstox response."""
+        headers = headers or {}
+        with self._lock:
+            state = self._tokens.get(role)
+            if state is None:
+                return
+            now = self._clock()
+            if status_code == 401:
+                state.invalid = True
+                return
+            remaining = headers.get('X-RateLimit-Remaining')
+            if remaining is not None:
+                try:
+                    state.remaining = int(remaining)
+                except (TypeError, ValueError):
+                    pass
+            reset = headers.get('X-RateLimit-Reset')
+            if reset is not None:
+                try:
+                    state.window_reset_at = now + float(reset)
+                except (TypeError, ValueError):
+                    pass
+            if status_code == 429:
+                try:
+                    retry_after = float(headers.get('Retry-After', DEFAULT_RETRY_AFTER_SECONDS))
+                except (TypeError, ValueError):
+                    retry_after = DEFAULT_RETRY_AFTER_SECONDS
+                state.remaining = 0
+                state.cooldown_until = now + retry_after
+
+    def status(self):
+        """Per-role pool state, without the tokens themselves."""
+        self._ensure_loaded()
+        with self._lock:
+            now = self._clock()
+            pool_status = []
+            for state in self._tokens.values():
+                reason = self._unavailable_reason(state, now)
+                pool_status.append({
+                    'role': state.role,
+                    'available': reason is None,
+                    'reason': reason,
+                    'remaining': state.remaining,
+                    'expires_at': (datetime.fromtimestamp(state.expires_at, timezone.utc).isoformat()
+                                   if state.expires_at is not None else None),
+                })
+            return pool_status
@@ -0,0 +1,59 @@
+import requests
+
+DEFAULT_BASE_URL = "https://api.upstox.com"
+
+
+class UpstoxClient:
+    """
+    Thin wrapper over the Upstox v2 endpoints used by the app.
+    Requests go through one pooled session so connections are reused across fetches.
+    Methods return the raw requests.Response; callers handle status codes.
+    """
+
+    def __init__(self, client_id=None, client_secret=None, redirect_uri=None, base_url=DEFAULT_BASE_URL,
+                 session=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        self.session = session or requests.Session()
+
+    @property
+    def can_login(self):
+        return all([self.client_id, self.redirect_uri])
+
+    @property
+    def can_exchange_code(self):
+        return all([self.client_id, self.client_secret, self.redirect_uri])
+
+    def login_url(self):
+        return (
+            f"{self.base_url}/v2/login/authorization/dialog?"
+            f"client_id={self.client_id}&"
+            f"redirect_uri={self.redirect_uri}&"
+            f"response_type=code"
+        )
+
+    def exchange_code(self, code):
+        url = f"{self.base_url}/v2/login/authorization/token"
+        headers = {"accept": "application/json", "Content-Type": "application/x-www-form-urlencoded"}
+        data = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "redirect_uri": self.redirect_uri,
+            "grant_type": "authorization_code",
+            "code": code,
+        }
+        return self.session.post(url, headers=headers, data=data)
+
+    def get_option_chain(self, access_token, instrument_key, expiry_date):
+        url = f"{self.base_url}/v2/option/chain"
+        headers = {
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {access_token}'
+        }
+        params = {
+            'instrument_key': instrument_key,
+            'expiry_date': expiry_date
+        }
+        return self.session.get(url, headers=headers, params=params)
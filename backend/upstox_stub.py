@@ -0,0 +1,221 @@
+"""
+Deterministic Upstox-compatible stub server for offline load testing.
+
+Serves /v2/option/chain and /v2/login/authorization/token with configurable
+latency, chain size, error rates and an optional per-token rate budget.
+Point the backend at it with UPSTOX_BASE_URL=http://localhost:9000 and drive
+it with load_test.py.
+
+    python upstox_stub.py --port 9000 --latency-ms 80 --jitter-ms 20 --strikes 120 --error-rate 0.01 \\
+        --rate-limit-per-token 500 --rate-limit-window-s 60
+
+Given the same seed and the same request order the stub returns identical
+payloads, latencies and errors.
+"""
+import argparse
+import math
+import random
+import threading
+import time
+from flask import Flask, jsonify, request
+
+DEFAULT_SPOT_PRICE = 24500.0
+DEFAULT_STRIKE_STEP = 50
+
+
+def generate_option_chain(instrument_key, expiry_date, strikes, tick=0, seed=0,
+                          spot_price=DEFAULT_SPOT_PRICE, strike_step=DEFAULT_STRIKE_STEP):
+    """
+    Builds an Upstox v2 option chain payload with `strikes` strikes centred on the spot price.
+    The chain is a pure function of its arguments; `tick` drifts the prices between polls.
+    """
+    rng = random.Random(f"{seed}|{instrument_key}|{expiry_date}|{tick}")
+    spot = round(spot_price + rng.uniform(-1, 1) * strike_step, 2)
+    atm = round(spot / strike_step) * strike_step
+    first_strike = atm - (strikes // 2) * strike_step
+
+    def option_leg(side, strike):
+        intrinsic = max(spot - strike, 0) if side == 'CE' else max(strike - spot, 0)
+        ltp = round(intrinsic + rng.uniform(5, 60), 2)
+        oi = rng.randint(1000, 5000000)
+        return {
+            'instrument_key': f"NSE_FO|{side}{int(strike)}",
+            'market_data': {
+                'ltp': ltp,
+                'volume': rng.randint(0, 20000000),
+                'oi': oi,
+                'close_price': round(ltp * rng.uniform(0.9, 1.1), 2),
+                'bid_price': round(ltp - 0.05, 2),
+                'bid_qty': rng.randint(0, 50000),
+                'ask_price': round(ltp + 0.05, 2),
+                'ask_qty': rng.randint(0, 50000),
+                'prev_oi': int(oi * rng.uniform(0.8, 1.2)),
+            },
+            'option_greeks': {
+                'vega': round(rng.uniform(0, 20), 4),
+                'theta': round(rng.uniform(-20, 0), 4),
+                'gamma': round(rng.uniform(0, 0.01), 4),
+                'delta': round(rng.uniform(0, 1) if side == 'CE' else rng.uniform(-1, 0), 4),
+                'iv': round(rng.uniform(8, 30), 2),
+                'pop': round(rng.uniform(0, 100), 2),
+            },
+        }
+
+    data = []
+    for i in range(strikes):
+        strike = float(first_strike + i * strike_step)
+        call_options = option_leg('CE', strike)
+        put_options = option_leg('PE', strike)
+        call_oi = call_options['market_data']['oi']
+        data.append({
+            'expiry': expiry_date,
+            'pcr': round(put_options['market_data']['oi'] / call_oi, 4) if call_oi else 0,
+            'strike_price': strike,
+            'underlying_key': instrument_key,
+            'underlying_spot_price': spot,
+            'call_options': call_options,
+            'put_options': put_options,
+        })
+    return {'status': 'success', 'data': data}
+
+
+def create_stub_app(latency_ms=0, jitter_ms=0, strikes=100, error_rate=0.0, rate_limit_rate=0.0,
+                    unauthorized_rate=0.0, seed=0, rate_limit_per_token=None, rate_limit_window_s=60,
+                    clock=time.monotonic):
+    """
+    Creates the stub Flask app.
+    - latency_ms / jitter_ms: added response delay (uniform jitter)
+    - strikes: number of strikes in every option chain
+    - error_rate / rate_limit_rate / unauthorized_rate: fraction of option chain
+      requests answered with 500 / 429 / 401
+    - rate_limit_per_token / rate_limit_window_s: option chain requests each bearer
+      token may make per window. Responses carry X-RateLimit-Remaining and
+      X-RateLimit-Reset (seconds until the window resets); once the budget is
+      spent requests get 429 with Retry-After. None disables the budget.
+    """
+    app = Flask(__name__)
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    ticks = {}
+    # bearer token -> [window reset time, requests left]
+    budgets = {}
+
+    def spend_budget(access_token):
+        # Returns (allowed, remaining, seconds until reset) for one request
+        with lock:
+            now = clock()
+            budget = budgets.get(access_token)
+            if budget is None or now >= budget[0]:
+                budget = budgets[access_token] = [now + rate_limit_window_s, rate_limit_per_token]
+            allowed = budget[1] > 0
+            if allowed:
+                budget[1] -= 1
+            return allowed, budget[1], max(budget[0] - now, 0)
+
+    def draw():
+        # One draw per request keeps the error and latency sequence reproducible
+        with lock:
+            return rng.random(), rng.uniform(-jitter_ms, jitter_ms)
+
+    def delay(jitter):
+        pause = max(latency_ms + jitter, 0) / 1000
+        if pause:
+            time.sleep(pause)
+
+    def error_response(status_code, error_code, message):
+        return jsonify({'status': 'error', 'errors': [{'errorCode': error_code, 'message': message}]}), status_code
+
+    @app.route("/v2/login/authorization/token", methods=['POST'])
+    def token():
+        _, jitter = draw()
+        delay(jitter)
+        code = request.form.get('code')
+        if not code:
+            return error_response(400, 'UDAPI100069', 'Check your code')
+        return jsonify({
+            'email': 'stub@example.com',
+            'exchanges': ['NSE', 'NFO'],
+            'products': ['D', 'I'],
+            'broker': 'UPSTOX',
+            'user_id': f"STUB-{code}",
+            'user_name': 'Stub User',
+            'order_types': ['MARKET', 'LIMIT'],
+            'user_type': 'individual',
+            'poa': False,
+            'is_active': True,
+            'access_token': f"stub-token-{code}",
+            'extended_token': None,
+        })
+
+    @app.route("/v2/option/chain", methods=['GET'])
+    def option_chain():
+        roll, jitter = draw()
+        delay(jitter)
+        authorization = request.headers.get('Authorization', '')
+        if not authorization.startswith('Bearer '):
+            return error_response(401, 'UDAPI100050', 'Invalid token used to access API')
+        if rate_limit_per_token is None:
+            return option_chain_response(roll)
+
+        allowed, remaining, reset = spend_budget(authorization[len('Bearer '):])
+        if allowed:
+            response, status_code = option_chain_response(roll)
+        else:
+            response, status_code = error_response(429, 'UDAPI10005', 'Too Many Request Sent')
+            response.headers['Retry-After'] = str(math.ceil(reset))
+        response.headers['X-RateLimit-Remaining'] = str(remaining)
+        response.headers['X-RateLimit-Reset'] = f"{reset:.3f}"
+        return response, status_code
+
+    def option_chain_response(roll):
+        instrument_key = request.args.get('instrument_key')
+        expiry_date = request.args.get('expiry_date')
+        if not instrument_key or not expiry_date:
+            return error_response(400, 'UDAPI1088', 'Invalid instrument_key or expiry_date')
+
+        if roll < unauthorized_rate:
+            return error_response(401, 'UDAPI100050', 'Invalid token used to access API')
+        roll -= unauthorized_rate
+        if roll < rate_limit_rate:
+            response, status_code = error_response(429, 'UDAPI10005', 'Too Many Request Sent')
+            response.headers['Retry-After'] = '1'
+            return response, status_code
+        roll -= rate_limit_rate
+        if roll < error_rate:
+            return error_response(500, 'UDAPI100500', 'Something went wrong')
+
+        with lock:
+            tick = ticks.get((instrument_key, expiry_date), 0)
+            ticks[(instrument_key, expiry_date)] = tick + 1
+        return jsonify(generate_option_chain(instrument_key, expiry_date, strikes, tick=tick, seed=seed)), 200
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Deterministic Upstox stub server")
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--strikes', type=int, default=100)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--unauthorized-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate-limit-per-token', type=int,
+                        help="option chain requests allowed per token per window (default: unlimited)")
+    parser.add_argument('--rate-limit-window-s', type=float, default=60)
+    args = parser.parse_args()
+
+    stub_app = create_stub_app(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        strikes=args.strikes,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        unauthorized_rate=args.unauthorized_rate,
+        seed=args.seed,
+        rate_limit_per_token=args.rate_limit_per_token,
+        rate_limit_window_s=args.rate_limit_window_s,
+    )
+    stub_app.run(port=args.port, threaded=True)